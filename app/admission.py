@@ -0,0 +1,171 @@
+import asyncio
+import math
+import time
+from collections import Counter, deque
+from collections.abc import AsyncGenerator
+from contextlib import asynccontextmanager
+
+from app.config import AdmissionConfig
+from app.errors import UnavailableError
+
+# weight of the latest request in the average request duration
+LATENCY_SMOOTHING = 0.1
+
+# key shared by the requests whose token the upstream has not verified yet
+UNVERIFIED_KEY = "unverified"
+
+
+class AdmissionLimiter:
+    """Bounds the requests of a route served at once, the excess waits in a
+    queue of bounded depth and time, beyond that requests are rejected fast.
+
+    With a fair share every key (e.g. a verified bearer token) may hold at most
+    an equal part of the slots, in flight and queued. A full queue then makes room for a
+    key below its share by rejecting the latest waiter of the key holding the
+    most, so that one client cannot crowd out the others.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int,
+        max_queue: int,
+        queue_timeout: float,
+        fair_share: bool = False,
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.fair_share = fair_share
+        self.in_flight = 0
+        self.queue: deque[tuple[str, asyncio.Future[None]]] = deque()
+        # slots held per key, in flight and queued
+        self.holders: Counter[str] = Counter()
+        self.admitted = 0
+        self.completed = 0
+        self.rejected: Counter[str] = Counter()
+        # moving average of admitted request durations, for Retry-After
+        self.latency = 0.0
+
+    def fair_limit(self, key: str) -> int:
+        holders = len(self.holders) + (key not in self.holders)
+        return max(1, (self.max_in_flight + self.max_queue) // holders)
+
+    def retry_after(self) -> int:
+        """Seconds until the current queue is likely drained"""
+        waiting = len(self.queue) + 1
+        return max(1, math.ceil(self.latency * waiting / self.max_in_flight))
+
+    def reject(self, reason: str) -> UnavailableError:
+        self.rejected[reason] += 1
+        return UnavailableError(
+            code="overloaded",
+            message="Too many requests right now",
+            detail="Please try again later",
+            headers={"Retry-After": str(self.retry_after())},
+        )
+
+    def release(self) -> None:
+        # the slot goes straight to the next waiter, if any
+        while self.queue:
+            _, waiter = self.queue.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    def evict(self, key: str) -> bool:
+        """Rejects the latest waiter of the key holding the most slots, when it
+        holds more than `key` would with one more"""
+        heaviest, held = self.holders.most_common(1)[0]
+        if held <= self.holders[key] + 1:
+            return False
+        for entry in reversed(self.queue):
+            if entry[0] == heaviest and not entry[1].done():
+                self.queue.remove(entry)
+                entry[1].set_exception(self.reject("fair_share"))
+                return True
+        return False
+
+    async def wait(self, key: str) -> None:
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (key, waiter)
+        self.queue.append(entry)
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except BaseException as e:
+            if waiter.done() and not waiter.cancelled() and not waiter.exception():
+                # the slot was handed over just as the wait ended
+                self.release()
+            elif entry in self.queue:
+                self.queue.remove(entry)
+            if isinstance(e, TimeoutError):
+                raise self.reject("queue_timeout")
+            raise
+
+    @asynccontextmanager
+    async def admit(self, key: str) -> AsyncGenerator[None]:
+        if self.fair_share and self.holders[key] >= self.fair_limit(key):
+            raise self.reject("fair_share")
+        if self.in_flight < self.max_in_flight and not self.queue:
+            self.in_flight += 1
+            self.holders[key] += 1
+        elif len(self.queue) < self.max_queue or (self.fair_share and self.evict(key)):
+            self.holders[key] += 1
+            try:
+                await self.wait(key)
+            except BaseException:
+                self.forget(key)
+                raise
+        else:
+            raise self.reject("queue_full")
+        self.admitted += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.completed += 1
+            if self.completed == 1:
+                # overlapping requests may finish in any order
+                self.latency = elapsed
+            else:
+                self.latency += LATENCY_SMOOTHING * (elapsed - self.latency)
+            self.forget(key)
+            self.release()
+
+    def forget(self, key: str) -> None:
+        self.holders[key] -= 1
+        if self.holders[key] <= 0:
+            del self.holders[key]
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queued": len(self.queue),
+            "admitted": self.admitted,
+            "completed": self.completed,
+            "rejected_queue_full": self.rejected["queue_full"],
+            "rejected_queue_timeout": self.rejected["queue_timeout"],
+            "rejected_fair_share": self.rejected["fair_share"],
+            "latency_seconds": self.latency,
+        }
+
+
+def create_limiters(config: AdmissionConfig) -> dict[str, AdmissionLimiter]:
+    """Limiters by route group, groups without a limit admit every request"""
+    limits = {
+        "products": (config.products_max_in_flight, config.products_max_queue),
+        "product": (config.product_max_in_flight, config.product_max_queue),
+    }
+    return {
+        route: AdmissionLimiter(
+            max_in_flight,
+            max_queue,
+            queue_timeout=config.queue_timeout,
+            fair_share=config.fair_share,
+        )
+        for route, (max_in_flight, max_queue) in limits.items()
+        if max_in_flight > 0
+    }
@@ -0,0 +1,77 @@
+from collections import OrderedDict
+from collections.abc import Hashable
+
+from app.models import Pagination
+
+
+class CachedResponse:
+    """Serialized JSON body of a response and its strong etag"""
+
+    def __init__(self, body: bytes, etag: str, meta: Pagination | None = None):
+        self.body = body
+        self.etag = etag
+        self.meta = meta
+
+    def __len__(self) -> int:
+        return len(self.body)
+
+
+class ResponseCache:
+    """LRU cache of serialized responses bounded by entry count and body bytes.
+
+    Entries belong to one catalog snapshot version, looking up or storing an
+    entry for another version drops everything cached for the previous one.
+    """
+
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.version: str | None = None
+        self.entries: OrderedDict[Hashable, CachedResponse] = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def use_version(self, version: str) -> None:
+        if version != self.version:
+            if self.entries:
+                self.invalidations += 1
+            self.entries.clear()
+            self.size = 0
+            self.version = version
+
+    def get(self, version: str, key: Hashable) -> CachedResponse | None:
+        self.use_version(version)
+        cached = self.entries.get(key)
+        if cached is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return cached
+
+    def put(self, version: str, key: Hashable, cached: CachedResponse) -> None:
+        self.use_version(version)
+        if len(cached) > self.max_bytes or self.max_entries <= 0:
+            return
+        previous = self.entries.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous)
+        self.entries[key] = cached
+        self.size += len(cached)
+        while len(self.entries) > self.max_entries or self.size > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,412 @@
+import time
+from array import array
+from bisect import bisect_left
+from collections.abc import Callable, Iterable, Sequence
+from typing import Any
+
+from app.collation import collation_key
+from app.ingest import parse_products
+from app.models import Product
+from app.processing import ProductTransform, process_product
+from app.search import SearchIndex
+from app.store import (
+    PRODUCT_FIELDS,
+    Buffer,
+    CategoryColumn,
+    Column,
+    OverlayColumn,
+    ProductStore,
+    ProductStoreBuilder,
+    TextColumnBuilder,
+)
+
+SEARCHABLE_FIELDS = ("naziv", "brandName", "categoryName")
+
+
+def number_key(value: Any) -> float | None:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def text_key(value: str | None) -> Any:
+    return None if value is None else collation_key(value)
+
+
+SORT_KEYS: dict[str, Callable[[Any], Any]] = {
+    "price": number_key,
+    "naziv": text_key,
+    "stock": number_key,
+    "brandName": text_key,
+    "categoryName": text_key,
+}
+
+
+# sort key of missing values, after every (0, key) of a present one
+MISSING_KEY = (1,)
+
+
+class FieldRanks:
+    """Dense ranks of one field in sort order, so sorting compares integers.
+
+    Value `i` in sort order has rank `2 * i + 1`, the even ranks are left for
+    values that are not in the catalog (see `rank`). Missing values sort last,
+    also in descending order (see `flip`).
+    """
+
+    def __init__(
+        self, values: Sequence[Any], codes: Sequence[int], key: Callable[[Any], Any]
+    ):
+        self.key = key
+        # every distinct value is keyed once
+        keys = [self.sort_key(value) for value in values]
+        # the missing key is always there, so that its rank is known
+        self.keys = sorted({*keys, MISSING_KEY})
+        rank_of = {k: 2 * i + 1 for i, k in enumerate(self.keys)}
+        code_ranks = [rank_of[k] for k in keys]
+        self.ranks = array("I", (code_ranks[code] for code in codes))
+        self.size = 2 * len(self.keys) + 1
+        self.missing = rank_of[MISSING_KEY]
+        self.descending_ranks: array | None = None
+
+    def flip(self, rank: int) -> int:
+        """The rank in descending order, missing values stay last"""
+        return rank if rank >= self.missing else self.missing - 1 - rank
+
+    def descending(self) -> array:
+        """Ranks of the positions in descending order, built on first use"""
+        if self.descending_ranks is None:
+            flipped = [self.flip(rank) for rank in range(self.size)]
+            self.descending_ranks = array("I", (flipped[r] for r in self.ranks))
+        return self.descending_ranks
+
+    @classmethod
+    def of(cls, column: Any, key: Callable[[Any], Any]) -> "FieldRanks":
+        if isinstance(column, CategoryColumn):
+            return cls(column.values, column.codes, key)
+        lookup: dict[Any, int] = {}
+        codes = array("I", (lookup.setdefault(value, len(lookup)) for value in column))
+        return cls(list(lookup), codes, key)
+
+    def sort_key(self, value: Any) -> tuple:
+        key = self.key(value)
+        return MISSING_KEY if key is None else (0, key)
+
+    def rank(self, value: Any) -> int:
+        """Rank of any value, also of one from another catalog snapshot"""
+        key = self.sort_key(value)
+        i = bisect_left(self.keys, key)
+        found = i < len(self.keys) and self.keys[i] == key
+        return 2 * i + 1 if found else 2 * i
+
+
+class IdIndex:
+    """Position of every product id, of duplicate ids the first counts"""
+
+    def __init__(self, positions: dict[str, int]):
+        self.positions = positions
+
+    @classmethod
+    def build(cls, column: Column) -> "IdIndex":
+        positions: dict[str, int] = {}
+        for pos in range(len(column)):
+            positions.setdefault(column[pos], pos)
+        return cls(positions)
+
+    def get(self, id: str) -> int | None:
+        return self.positions.get(id)
+
+    def sorted(self) -> "SortedIdIndex":
+        """The same index as flat buffers, as stored in a snapshot"""
+        ids = TextColumnBuilder()
+        positions = array("I")
+        for id in sorted(self.positions):
+            ids.append(id)
+            positions.append(self.positions[id])
+        return SortedIdIndex(ids.build(), positions)
+
+
+class SortedIdIndex:
+    """Position of every product id, as the ids in sorted order and their
+    positions, looked up by bisection. Read from a mapped snapshot, so that
+    the workers of a host share it"""
+
+    def __init__(self, ids: Column, positions: Buffer):
+        self.ids = ids
+        self.positions = positions
+
+    def get(self, id: str) -> int | None:
+        i = bisect_left(self.ids, id)
+        if i < len(self.positions) and self.ids[i] == id:
+            return self.positions[i]
+        return None
+
+    def sorted(self) -> "SortedIdIndex":
+        return self
+
+
+class Postings:
+    """Ascending positions per value of a dictionary encoded column, grouped by
+    value code in one buffer and addressed by offsets"""
+
+    def __init__(self, column: CategoryColumn, positions: Buffer, offsets: Buffer):
+        self.positions = positions
+        self.offsets = offsets
+        self.codes = {
+            value: code
+            for code, value in enumerate(column.values)
+            if value and offsets[code + 1] > offsets[code]
+        }
+
+    @classmethod
+    def build(cls, column: CategoryColumn) -> "Postings":
+        counts = [0] * len(column.values)
+        for code in column.codes:
+            counts[code] += 1
+        offsets = array("I", [0])
+        for count in counts:
+            offsets.append(offsets[-1] + count)
+        ends = array("I", offsets[:-1])
+        positions = array("I", bytes(4 * len(column.codes)))
+        for pos, code in enumerate(column.codes):
+            positions[ends[code]] = pos
+            ends[code] += 1
+        return cls(column, positions, offsets)
+
+    def __contains__(self, value: object) -> bool:
+        return value in self.codes
+
+    def __getitem__(self, value: str) -> Sequence[int]:
+        code = self.codes[value]
+        # a view, so that lists are sliced without copying, taken per lookup as
+        # the catalog is pickled when built in a worker process
+        view = memoryview(self.positions)
+        return view[self.offsets[code] : self.offsets[code + 1]]
+
+    def get(self, value: str) -> Sequence[int] | None:
+        return self[value] if value in self.codes else None
+
+
+class CatalogIndex:
+    """Lookup structures built once per catalog snapshot.
+
+    Products are referenced by their position in the catalog, inverted indexes
+    keep positions in ascending (catalog) order. A stored snapshot brings the
+    id index, postings and price orders along.
+    """
+
+    def __init__(
+        self,
+        store: ProductStore,
+        price_order: Buffer | None = None,
+        price_order_desc: Buffer | None = None,
+        sorted_prices: Sequence[float] | None = None,
+        by_id: IdIndex | SortedIdIndex | None = None,
+        by_brand_id: Postings | None = None,
+        by_category_id: Postings | None = None,
+    ):
+        if by_id is None:
+            by_id = IdIndex.build(store.column("sif_product"))
+        if by_brand_id is None:
+            by_brand_id = Postings.build(store.category_column("sif_productbrand"))
+        if by_category_id is None:
+            by_category_id = Postings.build(
+                store.category_column("sif_productcategory")
+            )
+        self.by_id: IdIndex | SortedIdIndex = by_id
+        self.by_brand_id = by_brand_id
+        self.by_category_id = by_category_id
+        self.prices = store.number_column("price")
+        # stable orders, equal prices keep catalog order in both directions
+        self.price_order: Buffer = price_order or array(
+            "I", sorted(range(len(store)), key=self.prices.__getitem__)
+        )
+        self.price_order_desc: Buffer = price_order_desc or array(
+            "I",
+            sorted(range(len(store)), key=self.prices.__getitem__, reverse=True),
+        )
+        self.sorted_prices: Sequence[float] = sorted_prices or array(
+            "d", (self.prices[pos] for pos in self.price_order)
+        )
+        # built on first use, keyed by (field, fold_diacritics)
+        self.search_indexes: dict[tuple[str, bool], SearchIndex] = {}
+        # built on first use, keyed by field
+        self.field_ranks: dict[str, FieldRanks] = {}
+
+    def sort_by_price(self, positions: Sequence[int], descending: bool) -> list[int]:
+        """Orders positions by price, ties keep catalog order"""
+        if len(positions) == len(self.prices):
+            return list(self.price_order_desc if descending else self.price_order)
+        # walking the precomputed order pays off unless the subset is small
+        if len(positions) * max(1, len(positions).bit_length()) < len(self.prices):
+            return sorted(
+                sorted(positions), key=self.prices.__getitem__, reverse=descending
+            )
+        members = set(positions)
+        order = self.price_order_desc if descending else self.price_order
+        return [pos for pos in order if pos in members]
+
+
+class Catalog:
+    """Immutable snapshot of the upstream product catalog.
+
+    `source` holds the products as returned by the upstream, filters and indexes
+    work on it. `served` holds the processed products at the same positions and
+    shares every column the processing left untouched.
+    """
+
+    def __init__(
+        self,
+        source: ProductStore,
+        served: ProductStore,
+        version: str,
+        fetched_at: float,
+        index: CatalogIndex | None = None,
+        etag: str | None = None,
+        last_modified: str | None = None,
+    ):
+        self.source = source
+        self.served = served
+        self.version = version
+        self.fetched_at = fetched_at
+        self.index = index or CatalogIndex(source)
+        # upstream validators, sent back on conditional requests
+        self.etag = etag
+        self.last_modified = last_modified
+
+    def __len__(self) -> int:
+        return len(self.source)
+
+    def refreshed(
+        self,
+        fetched_at: float,
+        etag: str | None = None,
+        last_modified: str | None = None,
+    ) -> "Catalog":
+        """Same snapshot, re-confirmed by the upstream at `fetched_at`"""
+        return Catalog(
+            source=self.source,
+            served=self.served,
+            version=self.version,
+            fetched_at=fetched_at,
+            index=self.index,
+            etag=etag or self.etag,
+            last_modified=last_modified or self.last_modified,
+        )
+
+    def age(self, now: float) -> float:
+        return now - self.fetched_at
+
+    def get(self, product_id: str) -> Product | None:
+        pos = self.index.by_id.get(product_id)
+        return None if pos is None else self.served.product(pos)
+
+    def search_index(self, field: str, fold_diacritics: bool = True) -> SearchIndex:
+        key = (field, fold_diacritics)
+        search_index = self.index.search_indexes.get(key)
+        if search_index is None:
+            if field not in SEARCHABLE_FIELDS:
+                raise ValueError(f"field {field} is not searchable")
+            column = self.source.column(field)
+            search_index = SearchIndex(
+                (column[pos] for pos in range(len(column))),
+                fold_diacritics=fold_diacritics,
+            )
+            self.index.search_indexes[key] = search_index
+        return search_index
+
+    def ranks(self, field: str) -> FieldRanks:
+        field_ranks = self.index.field_ranks.get(field)
+        if field_ranks is None:
+            key = SORT_KEYS.get(field)
+            if key is None:
+                raise ValueError(f"field {field} is not sortable")
+            field_ranks = FieldRanks.of(self.source.column(field), key)
+            self.index.field_ranks[field] = field_ranks
+        return field_ranks
+
+    def take(self, positions: Iterable[int]) -> list[Product]:
+        return [self.served.product(pos) for pos in positions]
+
+
+class CatalogBuilder:
+    """Encodes upstream products one by one into a catalog snapshot.
+
+    The served store shares the source columns and only keeps the values the
+    transforms actually changed, as overrides per position.
+    """
+
+    def __init__(self, transforms: Sequence[ProductTransform]):
+        self.transforms = transforms
+        self.source = ProductStoreBuilder()
+        self.overrides: dict[str, dict[int, Any]] = {}
+
+    def append(self, product: Product) -> None:
+        processed = process_product(product, self.transforms)
+        if processed is not product:
+            for field in PRODUCT_FIELDS:
+                value = getattr(processed, field)
+                if value != getattr(product, field):
+                    self.overrides.setdefault(field, {})[self.source.size] = value
+        self.source.append(product)
+
+    def extend(self, products: Iterable[Product]) -> None:
+        for product in products:
+            self.append(product)
+
+    def build(
+        self,
+        version: str,
+        fetched_at: float,
+        etag: str | None = None,
+        last_modified: str | None = None,
+    ) -> Catalog:
+        source = self.source.build()
+        served = ProductStore(
+            columns={
+                **source.columns,
+                **{
+                    field: OverlayColumn(source.columns[field], overrides)
+                    for field, overrides in self.overrides.items()
+                },
+            },
+            size=len(source),
+        )
+        return Catalog(
+            source=source,
+            served=served,
+            version=version,
+            fetched_at=fetched_at,
+            etag=etag,
+            last_modified=last_modified,
+        )
+
+
+def build_catalog_json(
+    content: bytes,
+    transforms: Sequence[ProductTransform],
+    version: str,
+    fetched_at: float,
+    etag: str | None = None,
+    last_modified: str | None = None,
+) -> tuple[Catalog, dict[str, float]]:
+    """Validates and encodes an upstream catalog response in one call, so it
+    can run in a worker thread or process. Returns the catalog and the seconds
+    spent per stage"""
+    started = time.perf_counter()
+    products = parse_products(content)
+    validated = time.perf_counter()
+    builder = CatalogBuilder(transforms)
+    builder.extend(products)
+    catalog = builder.build(
+        version=version,
+        fetched_at=fetched_at,
+        etag=etag,
+        last_modified=last_modified,
+    )
+    timings = {
+        "validate": validated - started,
+        "process": time.perf_counter() - validated,
+    }
+    return catalog, timings
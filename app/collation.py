@@ -0,0 +1,42 @@
+import re
+import unicodedata
+
+# Serbian latin alphabet, digraphs are letters of their own, foreign letters
+# take their usual latin place
+SERBIAN_ALPHABET = (
+    "a b c č ć d dž đ e f g h i j k l lj m n nj o p q r s š t u v w x y z ž".split()
+)
+SERBIAN_CYRILLIC = dict(
+    zip(
+        "абвгдђежзијклљмнњопрстћуфхцчџш",
+        "a b v g d đ e ž z i j k l lj m n nj o p r s t ć u f h c č dž š".split(),
+    )
+)
+LETTER_WEIGHTS = {letter: weight for weight, letter in enumerate(SERBIAN_ALPHABET)}
+LETTER_RE = re.compile("dž|lj|nj|.", re.DOTALL)
+
+
+def letter_weight(letter: str) -> int:
+    """Primary weight, digits and punctuation sort before letters by code point"""
+    weight = LETTER_WEIGHTS.get(letter)
+    if weight is None:
+        # accented foreign letters sort like their base letter, e.g. é like e
+        weight = LETTER_WEIGHTS.get(unicodedata.normalize("NFKD", letter)[:1])
+    if weight is None:
+        return ord(letter) - 0x110000
+    return weight
+
+
+def collation_key(text: str) -> tuple[tuple[int, ...], str]:
+    """Sort key ordering text like the Serbian locale does.
+
+    Letters compare by the Serbian alphabet (`c < č < ć < d < dž < đ`), cyrillic
+    sorts like its latin transliteration, case only breaks ties (lowercase first).
+    """
+    folded = "".join(SERBIAN_CYRILLIC.get(c, c) for c in text.casefold())
+    primary = tuple(
+        letter_weight(letter)
+        for letter in LETTER_RE.findall(folded)
+        if not letter.isspace()
+    )
+    return (primary, text.swapcase())
@@ -0,0 +1,47 @@
+import hashlib
+
+from fastapi import Response, status
+
+
+class NotModified:
+    """The client already has the current representation"""
+
+    def __init__(self, etag: str):
+        self.etag = etag
+
+
+def make_etag(*parts: str | bytes) -> str:
+    digest = hashlib.blake2b(digest_size=16)
+    for part in parts:
+        digest.update(part.encode() if isinstance(part, str) else part)
+        digest.update(b"\0")
+    return f'"{digest.hexdigest()}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against the current etag"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(
+        tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(",")
+    )
+
+
+def set_cache_headers(response: Response, etag: str, cache_control: str) -> None:
+    response.headers["ETag"] = etag
+    if cache_control:
+        response.headers["Cache-Control"] = cache_control
+
+
+def set_stale_header(response: Response, stale: bool) -> None:
+    """Flags responses from a catalog the upstream did not recently confirm"""
+    if stale:
+        response.headers["X-Catalog-Stale"] = "true"
+
+
+def not_modified_response(etag: str, cache_control: str) -> Response:
+    response = Response(status_code=status.HTTP_304_NOT_MODIFIED)
+    set_cache_headers(response, etag=etag, cache_control=cache_control)
+    return response
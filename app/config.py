@@ -0,0 +1,196 @@
+import os
+from typing import ClassVar, Literal, Self
+
+import httpx
+from pydantic import BaseModel, SecretStr, field_validator
+
+
+class EnvConfig(BaseModel):
+    """Settings read from environment variables, unset variables keep defaults"""
+
+    env: ClassVar[dict[str, str]] = {}
+
+    @classmethod
+    def from_env(cls) -> Self:
+        return cls.model_validate(
+            {
+                field: os.environ[name]
+                for field, name in cls.env.items()
+                if os.getenv(name)
+            }
+        )
+
+
+class CatalogConfig(EnvConfig):
+    ttl: float = 60.0
+    max_stale: float = 600.0
+    token_ttl: float = 60.0
+    search_fold_diacritics: bool = True
+    stream_ingest: bool = False
+    response_cache_entries: int = 1024
+    response_cache_bytes: int = 64 * 2**20
+    # directory of a catalog snapshot file shared by the workers of a host and
+    # restored on startup
+    snapshot_dir: str | None = None
+    # bounds between the price buckets of /products/facets
+    facet_price_buckets: list[float] = [1000, 2500, 5000, 10000, 25000, 50000, 100000]
+
+    env = {
+        "ttl": "KONOVO_CATALOG_TTL",
+        "max_stale": "KONOVO_CATALOG_MAX_STALE",
+        "token_ttl": "KONOVO_CATALOG_TOKEN_TTL",
+        "search_fold_diacritics": "KONOVO_SEARCH_FOLD_DIACRITICS",
+        "stream_ingest": "KONOVO_CATALOG_STREAM_INGEST",
+        "response_cache_entries": "KONOVO_RESPONSE_CACHE_ENTRIES",
+        "response_cache_bytes": "KONOVO_RESPONSE_CACHE_BYTES",
+        "facet_price_buckets": "KONOVO_FACET_PRICE_BUCKETS",
+        "snapshot_dir": "KONOVO_SNAPSHOT_DIR",
+    }
+
+    @field_validator("facet_price_buckets", mode="before")
+    @classmethod
+    def split_bounds(cls, value: object) -> object:
+        if isinstance(value, str):
+            value = [bound for bound in value.split(",") if bound.strip()]
+        return value
+
+    @field_validator("facet_price_buckets")
+    @classmethod
+    def sort_bounds(cls, value: list[float]) -> list[float]:
+        return sorted(set(value))
+
+
+class UpstreamConfig(EnvConfig):
+    # the Konovo API unless set, e.g. to a local stand-in
+    base_url: str | None = None
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    # needs the h2 package, e.g. `httpx[http2]`
+    http2: bool = False
+    connect_timeout: float = 3.0
+    # default read timeout, the catalog download and login have their own
+    read_timeout: float = 10.0
+    catalog_timeout: float = 20.0
+    login_timeout: float = 5.0
+    # attempts after the first one, only for idempotent requests
+    retries: int = 2
+    retry_backoff: float = 0.2
+    retry_max_backoff: float = 2.0
+    breaker_failures: int = 5
+    breaker_reset: float = 30.0
+
+    env = {
+        "base_url": "KONOVO_UPSTREAM_URL",
+        "max_connections": "KONOVO_UPSTREAM_MAX_CONNECTIONS",
+        "max_keepalive_connections": "KONOVO_UPSTREAM_MAX_KEEPALIVE",
+        "keepalive_expiry": "KONOVO_UPSTREAM_KEEPALIVE_EXPIRY",
+        "http2": "KONOVO_UPSTREAM_HTTP2",
+        "connect_timeout": "KONOVO_UPSTREAM_CONNECT_TIMEOUT",
+        "read_timeout": "KONOVO_UPSTREAM_READ_TIMEOUT",
+        "catalog_timeout": "KONOVO_UPSTREAM_CATALOG_TIMEOUT",
+        "login_timeout": "KONOVO_UPSTREAM_LOGIN_TIMEOUT",
+        "retries": "KONOVO_UPSTREAM_RETRIES",
+        "retry_backoff": "KONOVO_UPSTREAM_RETRY_BACKOFF",
+        "retry_max_backoff": "KONOVO_UPSTREAM_RETRY_MAX_BACKOFF",
+        "breaker_failures": "KONOVO_UPSTREAM_BREAKER_FAILURES",
+        "breaker_reset": "KONOVO_UPSTREAM_BREAKER_RESET",
+    }
+
+    def timeout(self, read: float) -> httpx.Timeout:
+        return httpx.Timeout(read, connect=self.connect_timeout)
+
+
+class AuthConfig(EnvConfig):
+    token_cache_entries: int = 10000
+    # cached tokens are replaced this many seconds before they expire
+    token_refresh_margin: float = 60.0
+
+    env = {
+        "token_cache_entries": "KONOVO_TOKEN_CACHE_ENTRIES",
+        "token_refresh_margin": "KONOVO_TOKEN_REFRESH_MARGIN",
+    }
+
+
+class RefresherConfig(EnvConfig):
+    # service account the catalog is refreshed with, no refresher without it
+    username: str | None = None
+    password: SecretStr | None = None
+    interval: float = 45.0
+    # fraction of the interval added or removed at random, so that workers
+    # started together do not refresh together
+    jitter: float = 0.1
+
+    env = {
+        "username": "KONOVO_SERVICE_USERNAME",
+        "password": "KONOVO_SERVICE_PASSWORD",
+        "interval": "KONOVO_REFRESH_INTERVAL",
+        "jitter": "KONOVO_REFRESH_JITTER",
+    }
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.username and self.password)
+
+
+class OffloadConfig(EnvConfig):
+    # where catalog validation and indexing run, `process` needs picklable
+    # product transforms
+    catalog_executor: Literal["inline", "thread", "process"] = "thread"
+    # where filtering, sorting and serialization of uncached queries run
+    query_executor: Literal["inline", "thread"] = "inline"
+    workers: int = 2
+    # jobs waiting for a worker per pool, more are rejected with 503
+    queue: int = 64
+    # seconds between event loop lag samples, 0 disables the monitor
+    loop_lag_interval: float = 0.1
+
+    env = {
+        "catalog_executor": "KONOVO_CATALOG_EXECUTOR",
+        "query_executor": "KONOVO_QUERY_EXECUTOR",
+        "workers": "KONOVO_EXECUTOR_WORKERS",
+        "queue": "KONOVO_EXECUTOR_QUEUE",
+        "loop_lag_interval": "KONOVO_LOOP_LAG_INTERVAL",
+    }
+
+
+class AdmissionConfig(EnvConfig):
+    # product requests served at once per route, 0 admits every request
+    products_max_in_flight: int = 0
+    product_max_in_flight: int = 0
+    # requests waiting for a slot per route, more are rejected with 503
+    products_max_queue: int = 32
+    product_max_queue: int = 64
+    # seconds a request waits for a slot before it is rejected
+    queue_timeout: float = 1.0
+    # limits every bearer token to an equal share of the slots
+    fair_share: bool = False
+
+    env = {
+        "products_max_in_flight": "KONOVO_ADMISSION_PRODUCTS_MAX_IN_FLIGHT",
+        "product_max_in_flight": "KONOVO_ADMISSION_PRODUCT_MAX_IN_FLIGHT",
+        "products_max_queue": "KONOVO_ADMISSION_PRODUCTS_MAX_QUEUE",
+        "product_max_queue": "KONOVO_ADMISSION_PRODUCT_MAX_QUEUE",
+        "queue_timeout": "KONOVO_ADMISSION_QUEUE_TIMEOUT",
+        "fair_share": "KONOVO_ADMISSION_FAIR_SHARE",
+    }
+
+
+class MetricsConfig(EnvConfig):
+    # Server-Timing headers and the /metrics endpoint, nothing is timed without
+    enabled: bool = False
+
+    env = {
+        "enabled": "KONOVO_METRICS",
+    }
+
+
+class HttpCacheConfig(EnvConfig):
+    # authenticated responses, clients revalidate with their etag
+    products_cache_control: str = "private, no-cache"
+    product_cache_control: str = "private, no-cache"
+
+    env = {
+        "products_cache_control": "KONOVO_CACHE_CONTROL_PRODUCTS",
+        "product_cache_control": "KONOVO_CACHE_CONTROL_PRODUCT",
+    }
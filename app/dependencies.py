@@ -1,8 +1,15 @@
+import time
+from collections.abc import AsyncGenerator, Callable
 from typing import Annotated
 from fastapi import Depends, Query, Request
 from fastapi.security import HTTPAuthorizationCredentials
+from app.admission import UNVERIFIED_KEY
 from app.auth import AuthorizationBearer
+from app.config import HttpCacheConfig
+from app.metrics import Metrics
 from app.models import PaginationFilters, ProductFilters
+from app.query import parse_ids
+from app.refresher import CatalogRefresher
 from app.services import AuthService, ProductService
 
 
@@ -15,6 +22,33 @@ def extract_jwt(
     return credentials.credentials
 
 
+def admission(route: str) -> Callable[..., AsyncGenerator[str]]:
+    """Admits the request through the limiter of its route group, holding a
+    slot while it is served, and yields the bearer token. Tokens count apart
+    once the upstream verified them, all others share one key, so that made up
+    tokens gain no share of their own"""
+
+    async def admit(
+        request: Request, jwt: str = Depends(extract_jwt)
+    ) -> AsyncGenerator[str]:
+        limiter = request.app.state.admission.get(route)
+        if limiter is None:
+            yield jwt
+            return
+        product_service: ProductService = request.app.state.product_service
+        key = UNVERIFIED_KEY
+        if product_service.was_token_verified(jwt, time.monotonic()):
+            key = product_service.token_key(jwt)
+        async with limiter.admit(key):
+            yield jwt
+
+    return admit
+
+
+admit_products = admission("products")
+admit_product = admission("product")
+
+
 def get_auth_service(request: Request) -> AuthService:
     return request.app.state.auth_service
 
@@ -23,6 +57,18 @@ def get_product_service(request: Request) -> ProductService:
     return request.app.state.product_service
 
 
+def get_catalog_refresher(request: Request) -> CatalogRefresher | None:
+    return request.app.state.catalog_refresher
+
+
+def get_metrics(request: Request) -> Metrics:
+    return request.app.state.metrics
+
+
+def get_http_cache_config(request: Request) -> HttpCacheConfig:
+    return request.app.state.http_cache_config
+
+
 def get_product_filters(
     name: Annotated[str | None, Query(title="name filter", max_length=100)] = None,
     brand_ids: Annotated[list[str] | None, Query(title="brand ids filter")] = None,
@@ -45,7 +91,14 @@ def get_product_filters(
     price_gte: Annotated[
         float | None, Query(title="price price_gte filter", min=0)
     ] = None,
-    sort: Annotated[str | None, Query(title="sort by filter")] = None,
+    sort: Annotated[
+        str | None,
+        Query(
+            title="sort by filter",
+            description="comma separated fields of price, naziv, stock, brandName,"
+            " categoryName, `-` sorts descending, e.g. `categoryName,-price`",
+        ),
+    ] = None,
 ) -> ProductFilters:
     return ProductFilters(
         name=name,
@@ -61,8 +114,17 @@ def get_product_filters(
     )
 
 
+def get_product_ids(
+    ids: Annotated[list[str], Query(title="product ids, comma separated")],
+) -> list[str]:
+    return parse_ids(ids)
+
+
 def get_pagination_filters(
     page: Annotated[int | None, Query(title="page", min=1)] = None,
     page_size: Annotated[int | None, Query(title="page_size", min=10)] = None,
+    cursor: Annotated[
+        str | None, Query(title="cursor", description="next_cursor of a previous page")
+    ] = None,
 ) -> PaginationFilters:
-    return PaginationFilters(page=page, page_size=page_size)
+    return PaginationFilters(page=page, page_size=page_size, cursor=cursor)
@@ -6,11 +6,25 @@ from fastapi.responses import JSONResponse
 
 
 class KonovoError(Exception):
-    def __init__(self, code: str, message: str, detail: str):
+    def __init__(
+        self,
+        code: str,
+        message: str,
+        detail: str,
+        headers: dict[str, str] | None = None,
+    ):
         super().__init__()
         self.code = code
         self.message = message
         self.detail = detail
+        # sent with the error response, e.g. Retry-After
+        self.headers = headers
+
+
+class BadRequestError(KonovoError):
+    """Request is malformed"""
+
+    pass
 
 
 class UnavailableError(KonovoError):
@@ -19,6 +33,12 @@ class UnavailableError(KonovoError):
     pass
 
 
+class ServerBusyError(UnavailableError):
+    """Local worker pool is full, says nothing about the upstream"""
+
+    pass
+
+
 class TimeOutError(KonovoError):
     """Operation was timed out"""
 
@@ -63,7 +83,9 @@ def create_exception_handler(status_code: int):
     }
 
     async def exception_handler(_: Request, exc: Exception) -> JSONResponse:
+        headers = None
         if isinstance(exc, KonovoError):
+            headers = exc.headers
             if exc.code:
                 out["code"] = exc.code
             if exc.message:
@@ -77,7 +99,7 @@ def create_exception_handler(status_code: int):
             out["detail"] = exc.errors()
 
         # log error here etc...
-        return JSONResponse(status_code=status_code, content={**out})
+        return JSONResponse(status_code=status_code, content={**out}, headers=headers)
 
     return exception_handler
 
@@ -92,6 +114,11 @@ def register_app_exception_handlers(app: FastAPI):
         handler=create_exception_handler(status.HTTP_422_UNPROCESSABLE_ENTITY),
     )
 
+    app.add_exception_handler(
+        exc_class_or_status_code=BadRequestError,
+        handler=create_exception_handler(status.HTTP_400_BAD_REQUEST),
+    )
+
     app.add_exception_handler(
         exc_class_or_status_code=UnavailableError,
         handler=create_exception_handler(status.HTTP_503_SERVICE_UNAVAILABLE),
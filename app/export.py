@@ -0,0 +1,56 @@
+from array import array
+from collections.abc import Iterator
+from typing import Literal
+
+from app.catalog import Catalog
+
+ExportFormat = Literal["ndjson", "json"]
+
+EXPORT_MEDIA_TYPES: dict[str, str] = {
+    "ndjson": "application/x-ndjson",
+    "json": "application/json",
+}
+# products are serialized into chunks of about this size
+EXPORT_CHUNK_BYTES = 64 * 2**10
+
+
+class ProductExport:
+    """Streamed export of catalog products, in the order of the positions"""
+
+    def __init__(
+        self,
+        catalog: Catalog,
+        positions: array,
+        format: ExportFormat,
+        etag: str,
+    ):
+        self.catalog = catalog
+        self.positions = positions
+        self.format = format
+        self.etag = etag
+
+    @property
+    def media_type(self) -> str:
+        return EXPORT_MEDIA_TYPES[self.format]
+
+    def chunks(self) -> Iterator[bytes]:
+        """Serializes products lazily, only one chunk is held at a time.
+
+        A plain generator, so the response iterates it in a worker thread and
+        only asks for the next chunk once the previous one was sent.
+        """
+        ndjson = self.format == "ndjson"
+        buffer = bytearray() if ndjson else bytearray(b"[")
+        for i, pos in enumerate(self.positions):
+            if not ndjson and i:
+                buffer += b","
+            buffer += self.catalog.served.product(pos).model_dump_json().encode()
+            if ndjson:
+                buffer += b"\n"
+            if len(buffer) >= EXPORT_CHUNK_BYTES:
+                yield bytes(buffer)
+                buffer.clear()
+        if not ndjson:
+            buffer += b"]"
+        if buffer:
+            yield bytes(buffer)
@@ -0,0 +1,107 @@
+import codecs
+import hashlib
+import json
+import re
+from collections.abc import AsyncIterable, AsyncIterator
+from typing import Any
+
+from pydantic import TypeAdapter
+
+from app.models import Product
+
+PRODUCTS_ADAPTER = TypeAdapter(list[Product])
+PRODUCT_ADAPTER = TypeAdapter(Product)
+
+WHITESPACE_RE = re.compile(r"[ \t\n\r]*")
+NUMBER_TAIL_RE = re.compile(r"[0-9.eE+-]*")
+
+
+def skip(pattern: re.Pattern[str], text: str, pos: int) -> int:
+    match = pattern.match(text, pos)
+    return match.end() if match else pos
+
+
+def parse_products(content: bytes) -> list[Product]:
+    """Validates the whole catalog straight from the response bytes"""
+    return PRODUCTS_ADAPTER.validate_json(content)
+
+
+class JSONArrayDecoder:
+    """Incrementally decodes the items of a top level JSON array.
+
+    Only the undecoded tail (at most one partial item plus one chunk) is kept
+    in memory between `feed` calls.
+    """
+
+    def __init__(self):
+        self.decoder = json.JSONDecoder()
+        self.text_decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buffer = ""
+        self.state = "start"
+
+    def error(self, message: str) -> ValueError:
+        return ValueError(f"invalid JSON array: {message}")
+
+    def feed(self, chunk: bytes, final: bool = False) -> list[Any]:
+        buf = self.buffer + self.text_decoder.decode(chunk, final)
+        pos = 0
+        items: list[Any] = []
+        while True:
+            pos = skip(WHITESPACE_RE, buf, pos)
+            if pos == len(buf):
+                break
+            char = buf[pos]
+            if self.state == "done":
+                raise self.error("unexpected data after the array")
+            if self.state == "start":
+                if char != "[":
+                    raise self.error("expected '['")
+                self.state = "item_or_end"
+                pos += 1
+            elif char == "]" and self.state in ("item_or_end", "comma_or_end"):
+                self.state = "done"
+                pos += 1
+            elif char == "," and self.state == "comma_or_end":
+                self.state = "item"
+                pos += 1
+            elif self.state in ("item", "item_or_end"):
+                try:
+                    item, end = self.decoder.raw_decode(buf, pos)
+                except json.JSONDecodeError:
+                    if final:
+                        raise
+                    break
+                # a number cut at the end of the buffer may continue in the next chunk
+                if (
+                    not final
+                    and isinstance(item, int | float)
+                    and skip(NUMBER_TAIL_RE, buf, end) == len(buf)
+                ):
+                    break
+                items.append(item)
+                self.state = "comma_or_end"
+                pos = end
+            else:
+                raise self.error(f"unexpected {char!r}")
+        self.buffer = buf[pos:]
+        if final and self.state != "done":
+            raise self.error("unexpected end of data")
+        return items
+
+
+async def digest_chunks(
+    chunks: AsyncIterable[bytes], digest: "hashlib._Hash"
+) -> AsyncIterator[bytes]:
+    async for chunk in chunks:
+        digest.update(chunk)
+        yield chunk
+
+
+async def stream_products(chunks: AsyncIterable[bytes]) -> AsyncIterator[Product]:
+    """Validates products one by one while the response is being received"""
+    decoder = JSONArrayDecoder()
+    async for chunk in chunks:
+        for item in decoder.feed(chunk):
+            yield PRODUCT_ADAPTER.validate_python(item)
+    for item in decoder.feed(b"", final=True):
+        yield PRODUCT_ADAPTER.validate_python(item)
@@ -1,25 +1,92 @@
 import os
 from contextlib import asynccontextmanager
 
-import httpx
 import uvicorn
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
+from app.admission import create_limiters
+from app.config import (
+    AdmissionConfig,
+    AuthConfig,
+    CatalogConfig,
+    HttpCacheConfig,
+    MetricsConfig,
+    OffloadConfig,
+    RefresherConfig,
+    UpstreamConfig,
+)
 from app.errors import register_app_exception_handlers
+from app.metrics import Metrics, MetricsMiddleware
+from app.offload import LoopLagMonitor
+from app.refresher import CatalogRefresher
 from app.routes import router
 from app.services import KONOVO_BASE_URL, AuthService, ProductService
+from app.upstream import create_client
+
+metrics = Metrics(enabled=MetricsConfig.from_env().enabled)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    app.state.http_client = httpx.AsyncClient(
-        base_url=KONOVO_BASE_URL,
-        headers={"Content-Type": "application/json", "Accept": "application/json"},
+    upstream_config = UpstreamConfig.from_env()
+    app.state.http_client = create_client(
+        upstream_config.base_url or KONOVO_BASE_URL, config=upstream_config
+    )
+    app.state.http_cache_config = HttpCacheConfig.from_env()
+    app.state.metrics = metrics
+    app.state.admission = create_limiters(AdmissionConfig.from_env())
+    offload_config = OffloadConfig.from_env()
+    app.state.loop_monitor = None
+    # its samples are only reported on /metrics
+    if metrics.enabled and offload_config.loop_lag_interval > 0:
+        app.state.loop_monitor = LoopLagMonitor(
+            offload_config.loop_lag_interval, metrics=metrics
+        )
+        app.state.loop_monitor.start()
+    app.state.auth_service = AuthService(
+        app.state.http_client,
+        upstream=upstream_config,
+        config=AuthConfig.from_env(),
+        metrics=metrics,
     )
-    app.state.auth_service = AuthService(app.state.http_client)
-    app.state.product_service = ProductService(app.state.http_client)
+    app.state.product_service = ProductService(
+        app.state.http_client,
+        config=CatalogConfig.from_env(),
+        upstream=upstream_config,
+        metrics=metrics,
+        offload=offload_config,
+    )
+    if metrics.enabled:
+        app.state.http_client.event_hooks["response"].append(
+            metrics.record_upstream_response
+        )
+        metrics.collect(
+            "konovo_response_cache", app.state.product_service.response_cache.stats
+        )
+        metrics.collect("konovo_token_cache", app.state.auth_service.stats)
+        metrics.collect(
+            "konovo_catalog_pool", app.state.product_service.catalog_pool.stats
+        )
+        metrics.collect("konovo_query_pool", app.state.product_service.query_pool.stats)
+        if app.state.loop_monitor:
+            metrics.collect("konovo_event_loop", app.state.loop_monitor.stats)
+        for route, limiter in app.state.admission.items():
+            metrics.collect(f"konovo_admission_{route}", limiter.stats)
+    await app.state.product_service.restore()
+    refresher_config = RefresherConfig.from_env()
+    app.state.catalog_refresher = None
+    if refresher_config.enabled:
+        app.state.catalog_refresher = CatalogRefresher(
+            app.state.auth_service, app.state.product_service, refresher_config
+        )
+        app.state.catalog_refresher.start()
     yield
+    if app.state.catalog_refresher:
+        await app.state.catalog_refresher.aclose()
+    await app.state.product_service.aclose()
+    if app.state.loop_monitor:
+        await app.state.loop_monitor.aclose()
     await app.state.http_client.aclose()
 
 
@@ -45,6 +112,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+if metrics.enabled:
+    # outermost, so that the timings cover the other middleware
+    app.add_middleware(MetricsMiddleware, metrics=metrics)
+
 app.include_router(router)
 
 if __name__ == "__main__":
@@ -0,0 +1,234 @@
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from collections.abc import Callable, Generator, Mapping
+from contextlib import AbstractContextManager, contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any
+
+import httpx
+
+# seconds, from a cache hit to a slow upstream download
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+
+NOT_TIMED = nullcontext()
+
+
+class Histogram:
+    def __init__(self, buckets: tuple[float, ...]):
+        self.buckets = buckets
+        # per bucket, the last one counts values above every bound
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def render(self, name: str, labels: str = "") -> list[str]:
+        lines = []
+        cumulative = 0
+        bucket_labels = f"{labels}," if labels else ""
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{bucket_labels}le="{bound}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{bucket_labels}le="+Inf"}} {self.count}')
+        labels = f"{{{labels}}}" if labels else ""
+        lines.append(f"{name}_sum{labels} {self.sum}")
+        lines.append(f"{name}_count{labels} {self.count}")
+        return lines
+
+
+class Timings:
+    """Stage durations of one request, sent back in a Server-Timing header"""
+
+    def __init__(self):
+        self.stages: dict[str, float] = {}
+
+    def add(self, stage: str, seconds: float) -> None:
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def header(self) -> str:
+        return ", ".join(
+            f"{stage};dur={seconds * 1000:.3f}"
+            for stage, seconds in self.stages.items()
+        )
+
+
+current_timings = ContextVar[Timings | None]("current_timings", default=None)
+
+
+def labels(**values: object) -> str:
+    return ",".join(f'{name}="{value}"' for name, value in values.items())
+
+
+class Metrics:
+    """Latency histograms per stage and route, upstream responses and in-flight
+    gauges, rendered in the Prometheus text format.
+
+    Disabled metrics time nothing, `stage` then returns a shared no-op context.
+    """
+
+    def __init__(
+        self, enabled: bool = True, buckets: tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        self.enabled = enabled
+        self.buckets = buckets
+        self.stages: dict[str, Histogram] = {}
+        self.stages_in_progress: defaultdict[str, int] = defaultdict(int)
+        self.requests: dict[tuple[str, str, int], Histogram] = {}
+        self.requests_in_flight = 0
+        self.loop_lag = Histogram(buckets)
+        self.upstream_responses: defaultdict[tuple[str, str, int], int] = defaultdict(
+            int
+        )
+        # gauges read when scraped, e.g. cache statistics
+        self.collectors: dict[str, Callable[[], Mapping[str, float]]] = {}
+
+    def stage(self, name: str) -> AbstractContextManager[Any]:
+        """Times the block as a stage of the current request"""
+        if not self.enabled:
+            return NOT_TIMED
+        return self.timed(name)
+
+    @contextmanager
+    def timed(self, name: str) -> Generator[None]:
+        self.stages_in_progress[name] += 1
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages_in_progress[name] -= 1
+            self.observe_stage(name, time.perf_counter() - started)
+
+    def observe_stage(self, name: str, seconds: float) -> None:
+        """Records a stage timed elsewhere, e.g. in a worker process"""
+        if not self.enabled:
+            return
+        self.histogram(self.stages, name).observe(seconds)
+        # None in background tasks, e.g. catalog refreshes
+        timings = current_timings.get()
+        if timings is not None:
+            timings.add(name, seconds)
+
+    def histogram[K](self, histograms: dict[K, Histogram], key: K) -> Histogram:
+        histogram = histograms.get(key)
+        if histogram is None:
+            histogram = histograms[key] = Histogram(self.buckets)
+        return histogram
+
+    def observe_request(
+        self, method: str, route: str, status: int, seconds: float
+    ) -> None:
+        self.histogram(self.requests, (method, route, status)).observe(seconds)
+
+    def observe_loop_lag(self, seconds: float) -> None:
+        if self.enabled:
+            self.loop_lag.observe(seconds)
+
+    async def record_upstream_response(self, response: httpx.Response) -> None:
+        """httpx response event hook"""
+        request = response.request
+        key = (request.method, request.url.path, response.status_code)
+        self.upstream_responses[key] += 1
+
+    def collect(
+        self, prefix: str, collector: Callable[[], Mapping[str, float]]
+    ) -> None:
+        self.collectors[prefix] = collector
+
+    def render(self) -> str:
+        lines = ["# TYPE konovo_request_duration_seconds histogram"]
+        for (method, route, status), histogram in self.requests.items():
+            lines += histogram.render(
+                "konovo_request_duration_seconds",
+                labels(method=method, route=route, status=status),
+            )
+        lines.append("# TYPE konovo_requests_in_flight gauge")
+        lines.append(f"konovo_requests_in_flight {self.requests_in_flight}")
+        lines.append("# TYPE konovo_stage_duration_seconds histogram")
+        for name, histogram in self.stages.items():
+            lines += histogram.render(
+                "konovo_stage_duration_seconds", labels(stage=name)
+            )
+        lines.append("# TYPE konovo_event_loop_lag_seconds histogram")
+        lines += self.loop_lag.render("konovo_event_loop_lag_seconds")
+        lines.append("# TYPE konovo_stage_in_progress gauge")
+        for name, count in self.stages_in_progress.items():
+            lines.append(f"konovo_stage_in_progress{{{labels(stage=name)}}} {count}")
+        lines.append("# TYPE konovo_upstream_responses_total counter")
+        for (method, path, status), count in self.upstream_responses.items():
+            lines.append(
+                f"konovo_upstream_responses_total"
+                f"{{{labels(method=method, path=path, status=status)}}} {count}"
+            )
+        for prefix, collector in self.collectors.items():
+            stats = collector()
+            for name, value in stats.items():
+                lines.append(f"# TYPE {prefix}_{name} gauge")
+                lines.append(f"{prefix}_{name} {value}")
+            if "hits" in stats and "misses" in stats:
+                lookups = stats["hits"] + stats["misses"]
+                ratio = stats["hits"] / lookups if lookups else 0.0
+                lines.append(f"# TYPE {prefix}_hit_ratio gauge")
+                lines.append(f"{prefix}_hit_ratio {ratio}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """Times every HTTP request, adds the Server-Timing header of its stages
+    and records its duration by route template"""
+
+    def __init__(self, app: Any, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope: dict, receive: Any, send: Any) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        timings = Timings()
+        token = current_timings.set(timings)
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_timings(message: dict) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                timings.add("total", time.perf_counter() - started)
+                headers = [
+                    *message.get("headers", []),
+                    (b"server-timing", timings.header().encode()),
+                ]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        self.metrics.requests_in_flight += 1
+        try:
+            await self.app(scope, receive, send_with_timings)
+        finally:
+            self.metrics.requests_in_flight -= 1
+            current_timings.reset(token)
+            # the template, not the path, keeps the number of series bounded
+            route = getattr(scope.get("route"), "path", "unmatched")
+            self.metrics.observe_request(
+                scope["method"], route, status, time.perf_counter() - started
+            )
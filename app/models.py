@@ -23,11 +23,27 @@ class Pagination(BaseModel):
     total: int
     page: int
     page_size: int
+    next_cursor: str | None = None
 
 
 class PaginationFilters(BaseModel):
     page: int | None
     page_size: int | None
+    cursor: str | None = None
+
+
+class Cursor(BaseModel):
+    version: str
+    sort: str
+    key: list[float | str | None] | None
+    id: str
+    position: int
+
+
+class HealthStatus(BaseModel):
+    status: str
+    catalog_version: str | None = None
+    catalog_age: float | None = None
 
 
 class LoginRequest(BaseModel):
@@ -60,6 +76,31 @@ class PaginatedProducts(BaseModel):
     meta: Pagination
 
 
+class ProductBatch(BaseModel):
+    products: list[Product]
+    missing: list[str]
+
+
+class FacetValue(BaseModel):
+    id: str
+    name: str | None
+    count: int
+
+
+class PriceBucket(BaseModel):
+    # min is inclusive, max exclusive, open ended buckets have no bound
+    min: float | None
+    max: float | None
+    count: int
+
+
+class ProductFacets(BaseModel):
+    total: int
+    brands: list[FacetValue]
+    categories: list[FacetValue]
+    prices: list[PriceBucket]
+
+
 class ProductFilters(BaseModel):
     name: str | None
     brand_ids: list[str] | None
@@ -0,0 +1,130 @@
+import asyncio
+import contextvars
+import functools
+import importlib
+import multiprocessing
+import time
+from collections.abc import Callable
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Literal
+
+from app.errors import ServerBusyError
+from app.metrics import Metrics
+
+ExecutorKind = Literal["inline", "thread", "process"]
+
+
+def server_busy_error() -> ServerBusyError:
+    return ServerBusyError(
+        code="server_busy",
+        message="Server is busy right now",
+        detail="Please try again later",
+    )
+
+
+def preload(module: str) -> None:
+    importlib.import_module(module)
+
+
+class WorkerPool:
+    """Runs CPU bound work off the event loop, so that other requests keep
+    being served meanwhile.
+
+    `inline` runs the work on the loop itself. Threads still share the GIL, but
+    the loop gets its turn every switch interval instead of waiting for the
+    whole job. Processes run in parallel, their arguments and results are
+    pickled. At most `workers + queue` jobs are pending, more fail fast.
+    """
+
+    def __init__(self, kind: ExecutorKind, workers: int, queue: int, name: str):
+        self.kind = kind
+        self.workers = workers
+        self.limit = workers + queue
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.executor: Executor | None = None
+        if kind == "thread":
+            self.executor = ThreadPoolExecutor(workers, thread_name_prefix=name)
+        elif kind == "process":
+            # spawned, forking a process that runs threads is unsafe
+            self.executor = ProcessPoolExecutor(
+                workers, mp_context=multiprocessing.get_context("spawn")
+            )
+
+    def warm_up(self, module: str) -> None:
+        """Starts worker processes and has them import `module` ahead of the
+        first job, instead of the first catalog load paying for it"""
+        if self.kind == "process" and self.executor is not None:
+            for _ in range(self.workers):
+                self.executor.submit(preload, module)
+
+    async def run[**P, T](
+        self, fn: Callable[P, T], *args: P.args, **kwargs: P.kwargs
+    ) -> T:
+        if self.executor is None:
+            return fn(*args, **kwargs)
+        if self.pending >= self.limit:
+            self.rejected += 1
+            raise server_busy_error()
+        call = functools.partial(fn, *args, **kwargs)
+        if self.kind == "thread":
+            # the stage timings of the current request keep being recorded
+            call = functools.partial(contextvars.copy_context().run, call)
+        self.pending += 1
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(
+                self.executor, call
+            )
+        finally:
+            self.pending -= 1
+        self.completed += 1
+        return result
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "workers": self.workers if self.executor else 0,
+            "pending": self.pending,
+            "completed": self.completed,
+            "rejected": self.rejected,
+        }
+
+    def shutdown(self) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+class LoopLagMonitor:
+    """Measures how much later than asked the event loop wakes a sleeping
+    task, which is how long it was blocked by synchronous work"""
+
+    def __init__(self, interval: float, metrics: Metrics):
+        self.interval = interval
+        self.metrics = metrics
+        self.last = 0.0
+        self.max = 0.0
+        self.task: asyncio.Task[None] | None = None
+
+    def start(self) -> None:
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    async def run(self) -> None:
+        while True:
+            started = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - started - self.interval)
+            self.last = lag
+            self.max = max(self.max, lag)
+            self.metrics.observe_loop_lag(lag)
+
+    def stats(self) -> dict[str, float]:
+        return {"lag_seconds": self.last, "max_lag_seconds": self.max}
+
+    async def aclose(self) -> None:
+        if self.task and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
@@ -1,9 +1,34 @@
+import base64
+
 from fastapi import Response
+from pydantic import ValidationError
 
-from app.models import Pagination
+from app.errors import BadRequestError
+from app.models import Cursor, Pagination
 
 
 def set_pagination_headers(response: Response, meta: Pagination) -> None:
     response.headers["X-Total-Count"] = str(meta.total)
     response.headers["X-Page"] = str(meta.page)
     response.headers["X-Page-Size"] = str(meta.page_size)
+    if meta.next_cursor:
+        response.headers["X-Next-Cursor"] = meta.next_cursor
+
+
+def encode_cursor(cursor: Cursor) -> str:
+    return base64.urlsafe_b64encode(cursor.model_dump_json().encode()).decode()
+
+
+def invalid_cursor_error(
+    detail: str = "Use the next_cursor of a previous page",
+) -> BadRequestError:
+    return BadRequestError(
+        code="invalid_cursor", message="Invalid cursor", detail=detail
+    )
+
+
+def decode_cursor(value: str) -> Cursor:
+    try:
+        return Cursor.model_validate_json(base64.urlsafe_b64decode(value))
+    except (ValueError, ValidationError):
+        raise invalid_cursor_error()
@@ -0,0 +1,194 @@
+from abc import ABC, abstractmethod
+from bisect import bisect_left, bisect_right
+from collections.abc import Iterable, Sequence
+from itertools import chain
+
+from app.catalog import Catalog, Postings
+from app.models import ProductFilters
+from app.query import PriceBounds, parse_ids
+from app.search import fold, ngrams
+
+
+class Predicate(ABC):
+    """One filter bound to a catalog snapshot.
+
+    `estimate` is an upper bound of the matches taken from the snapshot's
+    indexes, `candidates` the ascending positions the index yields (None when
+    the predicate cannot use an index) and `select` keeps the matching ones of
+    the given positions.
+    """
+
+    estimate: int
+    # whether every candidate matches, so that they need no `select`
+    exact: bool = True
+
+    def candidates(self) -> Sequence[int] | None:
+        return None
+
+    @abstractmethod
+    def select(self, positions: Iterable[int]) -> list[int]: ...
+
+
+class IdsPredicate(Predicate):
+    """Products whose id field holds one of `ids`, e.g. brand ids"""
+
+    def __init__(self, catalog: Catalog, field: str, postings: Postings, ids: set[str]):
+        column = catalog.source.category_column(field)
+        self.codes = column.codes
+        # empty values are in no posting list, they never match
+        self.allowed = {
+            code for code, value in enumerate(column.values) if value and value in ids
+        }
+        self.postings = [postings[id] for id in ids if id in postings]
+        self.estimate = sum(map(len, self.postings))
+
+    def candidates(self) -> Sequence[int]:
+        if len(self.postings) == 1:
+            return self.postings[0]
+        # a product has a single id, the posting lists are disjoint
+        return sorted(chain.from_iterable(self.postings))
+
+    def select(self, positions: Iterable[int]) -> list[int]:
+        codes, allowed = self.codes, self.allowed
+        return [pos for pos in positions if codes[pos] in allowed]
+
+
+class PricePredicate(Predicate):
+    def __init__(self, catalog: Catalog, bounds: PriceBounds):
+        index = catalog.index
+        self.prices = index.prices
+        self.price_order = index.price_order
+        self.bounds = bounds
+        self.lo, self.hi = 0, len(index.sorted_prices)
+        if bounds.min_price is not None:
+            bisect = bisect_left if bounds.min_inclusive else bisect_right
+            self.lo = bisect(index.sorted_prices, bounds.min_price)
+        if bounds.max_price is not None:
+            bisect = bisect_right if bounds.max_inclusive else bisect_left
+            self.hi = bisect(index.sorted_prices, bounds.max_price)
+        self.estimate = max(0, self.hi - self.lo)
+
+    def candidates(self) -> Sequence[int]:
+        return sorted(self.price_order[self.lo : self.hi])
+
+    def select(self, positions: Iterable[int]) -> list[int]:
+        prices, bounds = self.prices, self.bounds
+        low, high = bounds.min_price, bounds.max_price
+        if low is not None and bounds.min_inclusive:
+            positions = [pos for pos in positions if prices[pos] >= low]
+        elif low is not None:
+            positions = [pos for pos in positions if prices[pos] > low]
+        if high is not None and bounds.max_inclusive:
+            positions = [pos for pos in positions if prices[pos] <= high]
+        elif high is not None:
+            positions = [pos for pos in positions if prices[pos] < high]
+        return list(positions)
+
+
+class TextPredicate(Predicate):
+    """Products whose folded text contains the needle. Trigram postings give
+    candidates, which still need to be verified"""
+
+    exact = False
+
+    def __init__(
+        self, catalog: Catalog, field: str, needle: str, fold_diacritics: bool
+    ):
+        self.index = catalog.search_index(field, fold_diacritics=fold_diacritics)
+        self.texts = self.index.texts
+        self.needle = needle
+        grams = ngrams(needle)
+        self.postings = [self.index.postings.get(gram, ()) for gram in grams]
+        self.estimate = min(map(len, self.postings), default=len(catalog))
+
+    def candidates(self) -> Sequence[int] | None:
+        if not self.postings:
+            return None
+        return self.index.candidates(self.needle)
+
+    def select(self, positions: Iterable[int]) -> list[int]:
+        needle, texts = self.needle, self.texts
+        return [pos for pos in positions if needle in texts[pos]]
+
+
+class FilterPlan:
+    """`ProductFilters` compiled once per query: parsed id sets, folded
+    needles and price bounds.
+
+    Executed against a catalog, the predicates are ordered by their estimated
+    matches. The most selective one with an index yields the candidates, the
+    others narrow them down most selective first, each in one tight pass that
+    only sees what the previous ones kept.
+    """
+
+    def __init__(self, filters: ProductFilters, fold_diacritics: bool):
+        self.fold_diacritics = fold_diacritics
+        self.category_ids = (
+            set(parse_ids(filters.category_ids)) if filters.category_ids else None
+        )
+        self.brand_ids = (
+            set(parse_ids(filters.brand_ids)) if filters.brand_ids else None
+        )
+        # id filters replace the text filters of the same field
+        texts = {
+            "categoryName": None if filters.category_ids else filters.category,
+            "brandName": None if filters.brand_ids else filters.brand,
+            "naziv": filters.name,
+        }
+        self.texts = [
+            (field, fold(value, diacritics=fold_diacritics))
+            for field, value in texts.items()
+            if value
+        ]
+        self.bounds = PriceBounds(filters)
+
+    def predicates(self, catalog: Catalog) -> list[Predicate]:
+        index = catalog.index
+        predicates: list[Predicate] = []
+        if self.category_ids is not None:
+            predicates.append(
+                IdsPredicate(
+                    catalog,
+                    "sif_productcategory",
+                    index.by_category_id,
+                    self.category_ids,
+                )
+            )
+        if self.brand_ids is not None:
+            predicates.append(
+                IdsPredicate(
+                    catalog, "sif_productbrand", index.by_brand_id, self.brand_ids
+                )
+            )
+        if self.bounds:
+            predicates.append(PricePredicate(catalog, self.bounds))
+        for field, needle in self.texts:
+            predicates.append(
+                TextPredicate(
+                    catalog, field, needle, fold_diacritics=self.fold_diacritics
+                )
+            )
+        # stable, on equal estimates the cheaper checks listed first go first
+        predicates.sort(key=lambda predicate: predicate.estimate)
+        return predicates
+
+    def execute(self, catalog: Catalog) -> list[int]:
+        """Positions of the matching products, in catalog order"""
+        predicates = self.predicates(catalog)
+        if not predicates:
+            return list(range(len(catalog)))
+        if predicates[0].estimate == 0:
+            return []
+        positions: Sequence[int] = range(len(catalog))
+        for i, predicate in enumerate(predicates):
+            candidates = predicate.candidates()
+            if candidates is not None:
+                positions = candidates
+                if predicate.exact:
+                    del predicates[i]
+                break
+        for predicate in predicates:
+            positions = predicate.select(positions)
+            if not positions:
+                break
+        return list(positions)
@@ -0,0 +1,37 @@
+import re
+from collections.abc import Callable, Sequence
+
+from app.models import Product
+
+ProductTransform = Callable[[Product], Product]
+"""Derives the served product from the upstream one, must not mutate its input"""
+
+DESCRIPTION_PERFORMANCE_RE = re.compile(r"brzina", flags=re.IGNORECASE)
+
+
+def adjust_product_price_for_monitors(prod: Product) -> Product:
+    if prod.categoryName == "Monitori":
+        return prod.model_copy(update={"price": round(prod.price * 1.1, 2)})
+    return prod
+
+
+def adjust_product_description(prod: Product) -> Product:
+    if prod.description:
+        description = DESCRIPTION_PERFORMANCE_RE.sub("performanse", prod.description)
+        if description != prod.description:
+            return prod.model_copy(update={"description": description})
+    return prod
+
+
+DEFAULT_PRODUCT_TRANSFORMS: tuple[ProductTransform, ...] = (
+    adjust_product_price_for_monitors,
+    adjust_product_description,
+)
+
+
+def process_product(
+    product: Product, transforms: Sequence[ProductTransform]
+) -> Product:
+    for transform in transforms:
+        product = transform(product)
+    return product
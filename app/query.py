@@ -0,0 +1,161 @@
+from collections.abc import Callable, Hashable
+
+from app.catalog import Catalog
+from app.models import Cursor, PaginationFilters, ProductFilters
+from app.pagination import invalid_cursor_error
+from app.search import fold
+
+SORTABLE_FIELDS = ("price", "naziv", "stock", "brandName", "categoryName")
+# type of the values of each sortable field in a cursor key, besides None
+CURSOR_KEY_TYPES: dict[str, type] = {
+    "price": float,
+    "naziv": str,
+    "stock": str,
+    "brandName": str,
+    "categoryName": str,
+}
+
+
+def parse_ids(ids: list[str]) -> list[str]:
+    """A single value is a comma separated list, repeated values are used as is"""
+    if len(ids) == 1:
+        return [id.strip() for id in ids[0].split(",") if id.strip()]
+    return ids
+
+
+class PriceBounds:
+    def __init__(self, filters: ProductFilters):
+        # inclusive bounds win when both bounds of a side are given
+        self.min_price = (
+            filters.price_gte if filters.price_gte is not None else filters.price_gt
+        )
+        self.max_price = (
+            filters.price_lte if filters.price_lte is not None else filters.price_lt
+        )
+        self.min_inclusive = filters.price_gte is not None
+        self.max_inclusive = filters.price_lte is not None
+
+    def __bool__(self) -> bool:
+        return self.min_price is not None or self.max_price is not None
+
+    def key(self) -> Hashable:
+        return (self.min_price, self.min_inclusive, self.max_price, self.max_inclusive)
+
+
+class SortOrder:
+    """Order requested by the `sort` filter, ties keep catalog order.
+
+    `sort` is a comma separated list of fields, `-` sorts a field descending.
+    Unknown fields are ignored, without any field catalog order is kept.
+    """
+
+    def __init__(self, sort: str | None):
+        fields: dict[str, bool] = {}
+        for part in (sort or "").split(","):
+            field = part.strip().lstrip("-")
+            if field in SORTABLE_FIELDS and field not in fields:
+                fields[field] = part.strip().startswith("-")
+        self.fields = tuple(fields.items())
+
+    def __bool__(self) -> bool:
+        return bool(self.fields)
+
+    def __str__(self) -> str:
+        return ",".join(
+            f"-{field}" if descending else field for field, descending in self.fields
+        )
+
+    def values(self, catalog: Catalog, pos: int) -> list[float | str | None]:
+        return [catalog.source.column(field)[pos] for field, _ in self.fields]
+
+    def sort_key(self, catalog: Catalog) -> Callable[[int], int]:
+        """Total order of the positions as one integer per position, ascending"""
+        ranks = [
+            (catalog.ranks(field), descending) for field, descending in self.fields
+        ]
+        columns = [
+            (
+                field_ranks.descending() if descending else field_ranks.ranks,
+                field_ranks.size,
+            )
+            for field_ranks, descending in ranks
+        ]
+        size = len(catalog)
+
+        def key(pos: int) -> int:
+            k = 0
+            for column, column_size in columns:
+                k = k * column_size + column[pos]
+            return k * size + pos
+
+        return key
+
+    def cursor(self, catalog: Catalog, pos: int) -> Cursor:
+        return Cursor(
+            version=catalog.version,
+            sort=str(self),
+            key=self.values(catalog, pos) if self else None,
+            id=catalog.source.column("sif_product")[pos],
+            position=pos,
+        )
+
+    def after(self, catalog: Catalog, cursor: Cursor) -> int:
+        """Key of the last position of the previous page. On another catalog
+        version the product is looked up again by id, the position it had is
+        used when it was removed. A tampered cursor is a bad request"""
+        if cursor.version == catalog.version:
+            if not 0 <= cursor.position < len(catalog):
+                raise invalid_cursor_error()
+            return self.sort_key(catalog)(cursor.position)
+        key = cursor.key or []
+        if cursor.position < 0 or len(key) != len(self.fields):
+            raise invalid_cursor_error()
+        for (field, _), value in zip(self.fields, key):
+            if value is not None and not isinstance(value, CURSOR_KEY_TYPES[field]):
+                raise invalid_cursor_error()
+        # a removed product past the end sorts after its equals, the even ranks
+        # between values keep `len(catalog)` from reaching the next value
+        pos = catalog.index.by_id.get(cursor.id)
+        if pos is None:
+            pos = min(cursor.position, len(catalog))
+        k = 0
+        for (field, descending), value in zip(self.fields, key):
+            field_ranks = catalog.ranks(field)
+            rank = field_ranks.rank(value)
+            if descending:
+                rank = field_ranks.flip(rank)
+            k = k * field_ranks.size + rank
+        return k * len(catalog) + pos
+
+
+def filters_key(filters: ProductFilters, fold_diacritics: bool) -> tuple:
+    """Canonical form of the filters, equal for filters selecting the same
+    products, e.g. `brand_ids=1,2` and `brand_ids=2&brand_ids=1`"""
+
+    def ids(values: list[str] | None) -> Hashable:
+        return tuple(sorted(set(parse_ids(values)))) if values else None
+
+    def text(value: str | None) -> Hashable:
+        return fold(value, diacritics=fold_diacritics) if value else None
+
+    return (
+        ids(filters.category_ids),
+        ids(filters.brand_ids),
+        None if filters.category_ids else text(filters.category),
+        None if filters.brand_ids else text(filters.brand),
+        text(filters.name),
+        PriceBounds(filters).key(),
+    )
+
+
+def query_key(
+    filters: ProductFilters, pagination: PaginationFilters, fold_diacritics: bool
+) -> Hashable:
+    """Canonical form of a product query, equal for queries with equal results"""
+    return (
+        *filters_key(filters, fold_diacritics=fold_diacritics),
+        str(SortOrder(filters.sort)),
+        max(1, pagination.page or 1),
+        max(1, pagination.page_size) if pagination.page_size else None,
+        pagination.cursor,
+    )
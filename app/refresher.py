@@ -0,0 +1,85 @@
+import asyncio
+import random
+
+from app.config import RefresherConfig
+from app.errors import AuthenticationError
+from app.models import LoginRequest
+from app.services import AuthService, ProductService
+
+# first retry delay after a failed refresh, doubled up to the interval
+RETRY_DELAY = 1.0
+# bounds the doubling, a float power overflows after ~1000 failures
+MAX_RETRY_DOUBLINGS = 16
+
+
+class CatalogRefresher:
+    """Keeps the product catalog loaded with a service account, so requests
+    are not the ones paying for upstream fetches.
+
+    The first load starts with the app, later ones run every interval.
+    """
+
+    def __init__(
+        self,
+        auth_service: AuthService,
+        product_service: ProductService,
+        config: RefresherConfig,
+    ):
+        self.auth_service = auth_service
+        self.product_service = product_service
+        self.config = config
+        self.token: str | None = None
+        self.failures = 0
+        self.task: asyncio.Task[None] | None = None
+
+    def start(self) -> None:
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self.run())
+
+    def login_request(self) -> LoginRequest:
+        assert self.config.username and self.config.password
+        return LoginRequest(
+            username=self.config.username,
+            password=self.config.password.get_secret_value(),
+        )
+
+    async def login(self) -> str:
+        token = await self.auth_service.login(self.login_request())
+        return token.token
+
+    async def refresh(self) -> None:
+        # cached by the auth service, renewed shortly before it expires
+        self.token = await self.login()
+        try:
+            await self.product_service.coordinated_reload(jwt=self.token)
+        except AuthenticationError:
+            # the token expired, log in again right away
+            self.auth_service.forget(self.login_request())
+            self.token = await self.login()
+            await self.product_service.coordinated_reload(jwt=self.token)
+
+    def delay(self) -> float:
+        delay = self.config.interval
+        if self.failures:
+            doublings = min(self.failures - 1, MAX_RETRY_DOUBLINGS)
+            delay = min(delay, RETRY_DELAY * 2**doublings)
+        return delay * (1 + random.uniform(-self.config.jitter, self.config.jitter))
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.refresh()
+                self.failures = 0
+            except Exception:
+                # log error here etc... the current catalog keeps being served,
+                # also after e.g. an invalid catalog or an unwritable snapshot
+                self.failures += 1
+            await asyncio.sleep(self.delay())
+
+    async def aclose(self) -> None:
+        if self.task and not self.task.done():
+            self.task.cancel()
+            try:
+                await self.task
+            except asyncio.CancelledError:
+                pass
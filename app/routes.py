@@ -1,23 +1,45 @@
+import time
 from typing import Annotated, Any
 
-from fastapi import APIRouter, Body, Depends, Path, Response
+from fastapi import APIRouter, Body, Depends, Header, Path, Query, Response
+from fastapi.responses import PlainTextResponse, StreamingResponse
 
+from app.conditional import (
+    NotModified,
+    not_modified_response,
+    set_cache_headers,
+    set_stale_header,
+)
+from app.config import HttpCacheConfig
 from app.dependencies import (
+    admit_product,
+    admit_products,
     extract_jwt,
     get_auth_service,
+    get_catalog_refresher,
+    get_http_cache_config,
+    get_metrics,
     get_pagination_filters,
     get_product_filters,
+    get_product_ids,
     get_product_service,
 )
+from app.export import EXPORT_MEDIA_TYPES, ExportFormat
+from app.metrics import Metrics
 from app.pagination import set_pagination_headers
+from app.refresher import CatalogRefresher
 
+from .errors import NotFoundError, UnavailableError
 from .models import (
+    HealthStatus,
     KonovoApiError,
     KonovoValidationError,
     LoginRequest,
     PaginatedProducts,
     PaginationFilters,
     Product,
+    ProductBatch,
+    ProductFacets,
     ProductFilters,
     TokenResponse,
 )
@@ -30,6 +52,17 @@ response_internal_500: dict[int, dict[str, Any]] = {
     500: {"model": KonovoApiError, "description": "Internal Server Error"}
 }
 
+response_overloaded_503: dict[int, dict[str, Any]] = {
+    503: {
+        "model": KonovoApiError,
+        "description": "Too many requests right now, retry after Retry-After",
+    }
+}
+
+response_not_modified_304: dict[int, dict[str, Any]] = {
+    304: {"description": "Not modified, the etag in If-None-Match is current"}
+}
+
 
 router = APIRouter()
 
@@ -57,22 +90,135 @@ async def login(
     response_model=PaginatedProducts,
     responses={
         **response_internal_500,
+        **response_not_modified_304,
+        **response_overloaded_503,
         401: {"model": KonovoApiError, "description": "Unauthorized access"},
         422: {"model": KonovoValidationError, "description": "Validation error"},
     },
 )
 async def list_products(
-    response: Response,
     filters: ProductFilters = Depends(get_product_filters),
     pagination: PaginationFilters = Depends(get_pagination_filters),
+    if_none_match: Annotated[str | None, Header()] = None,
+    jwt: str = Depends(admit_products),
+    product_service: ProductService = Depends(get_product_service),
+    cache_config: HttpCacheConfig = Depends(get_http_cache_config),
+) -> Response:
+    page = await product_service.list_products_page(
+        jwt=jwt, filters=filters, pagination=pagination, if_none_match=if_none_match
+    )
+    cache_control = cache_config.products_cache_control
+    if isinstance(page, NotModified):
+        return not_modified_response(page.etag, cache_control=cache_control)
+    response = Response(content=page.body, media_type="application/json")
+    if page.meta:
+        set_pagination_headers(response, page.meta)
+    set_cache_headers(response, etag=page.etag, cache_control=cache_control)
+    set_stale_header(response, stale=product_service.is_stale())
+    return response
+
+
+# declared before /products/{product_id}, which would match them too
+@router.get(
+    "/products/batch",
+    operation_id="get_products_by_ids",
+    response_model=ProductBatch,
+    responses={
+        **response_internal_500,
+        **response_not_modified_304,
+        **response_overloaded_503,
+        400: {"model": KonovoApiError, "description": "Too many product ids"},
+        401: {"model": KonovoApiError, "description": "Unauthorized access"},
+        422: {"model": KonovoValidationError, "description": "Validation error"},
+    },
+)
+async def get_products_by_ids(
+    ids: list[str] = Depends(get_product_ids),
+    if_none_match: Annotated[str | None, Header()] = None,
+    jwt: str = Depends(admit_product),
+    product_service: ProductService = Depends(get_product_service),
+    cache_config: HttpCacheConfig = Depends(get_http_cache_config),
+) -> Response:
+    cached = await product_service.get_products_response(
+        jwt=jwt, ids=ids, if_none_match=if_none_match
+    )
+    cache_control = cache_config.product_cache_control
+    if isinstance(cached, NotModified):
+        return not_modified_response(cached.etag, cache_control=cache_control)
+    response = Response(content=cached.body, media_type="application/json")
+    set_cache_headers(response, etag=cached.etag, cache_control=cache_control)
+    set_stale_header(response, stale=product_service.is_stale())
+    return response
+
+
+@router.get(
+    "/products/export",
+    operation_id="export_products",
+    response_class=StreamingResponse,
+    responses={
+        **response_internal_500,
+        **response_not_modified_304,
+        **response_overloaded_503,
+        200: {
+            "description": "Every filtered product, one JSON document per line or"
+            " as a JSON array",
+            "content": {media_type: {} for media_type in EXPORT_MEDIA_TYPES.values()},
+        },
+        401: {"model": KonovoApiError, "description": "Unauthorized access"},
+        422: {"model": KonovoValidationError, "description": "Validation error"},
+    },
+)
+async def export_products(
+    filters: ProductFilters = Depends(get_product_filters),
+    format: Annotated[ExportFormat, Query(title="export format")] = "ndjson",
+    if_none_match: Annotated[str | None, Header()] = None,
+    # not admitted, FastAPI releases the slot of a yield dependency before the
+    # body is streamed
     jwt: str = Depends(extract_jwt),
     product_service: ProductService = Depends(get_product_service),
-) -> PaginatedProducts:
-    paginated_products = await product_service.list_products(
-        jwt=jwt, filters=filters, pagination=pagination
+    cache_config: HttpCacheConfig = Depends(get_http_cache_config),
+) -> Response:
+    export = await product_service.export_products(
+        jwt=jwt, filters=filters, format=format, if_none_match=if_none_match
+    )
+    cache_control = cache_config.products_cache_control
+    if isinstance(export, NotModified):
+        return not_modified_response(export.etag, cache_control=cache_control)
+    response = StreamingResponse(export.chunks(), media_type=export.media_type)
+    set_cache_headers(response, etag=export.etag, cache_control=cache_control)
+    set_stale_header(response, stale=product_service.is_stale())
+    return response
+
+
+@router.get(
+    "/products/facets",
+    operation_id="get_product_facets",
+    response_model=ProductFacets,
+    responses={
+        **response_internal_500,
+        **response_not_modified_304,
+        **response_overloaded_503,
+        401: {"model": KonovoApiError, "description": "Unauthorized access"},
+        422: {"model": KonovoValidationError, "description": "Validation error"},
+    },
+)
+async def get_product_facets(
+    filters: ProductFilters = Depends(get_product_filters),
+    if_none_match: Annotated[str | None, Header()] = None,
+    jwt: str = Depends(admit_products),
+    product_service: ProductService = Depends(get_product_service),
+    cache_config: HttpCacheConfig = Depends(get_http_cache_config),
+) -> Response:
+    cached = await product_service.get_facets_response(
+        jwt=jwt, filters=filters, if_none_match=if_none_match
     )
-    set_pagination_headers(response, paginated_products.meta)
-    return paginated_products
+    cache_control = cache_config.products_cache_control
+    if isinstance(cached, NotModified):
+        return not_modified_response(cached.etag, cache_control=cache_control)
+    response = Response(content=cached.body, media_type="application/json")
+    set_cache_headers(response, etag=cached.etag, cache_control=cache_control)
+    set_stale_header(response, stale=product_service.is_stale())
+    return response
 
 
 @router.get(
@@ -81,6 +227,8 @@ async def list_products(
     response_model=Product,
     responses={
         **response_internal_500,
+        **response_not_modified_304,
+        **response_overloaded_503,
         401: {"model": KonovoApiError, "description": "Unauthorized access"},
         404: {"model": KonovoApiError, "description": "Product not found"},
         422: {
@@ -91,7 +239,69 @@ async def list_products(
 )
 async def get_product_by_id(
     product_id: Annotated[int, Path(title="The ID of the product to get")],
-    jwt: str = Depends(extract_jwt),
+    if_none_match: Annotated[str | None, Header()] = None,
+    jwt: str = Depends(admit_product),
+    product_service: ProductService = Depends(get_product_service),
+    cache_config: HttpCacheConfig = Depends(get_http_cache_config),
+) -> Response:
+    cached = await product_service.get_product_response(
+        jwt=jwt, product_id=product_id, if_none_match=if_none_match
+    )
+    cache_control = cache_config.product_cache_control
+    if isinstance(cached, NotModified):
+        return not_modified_response(cached.etag, cache_control=cache_control)
+    response = Response(content=cached.body, media_type="application/json")
+    set_cache_headers(response, etag=cached.etag, cache_control=cache_control)
+    set_stale_header(response, stale=product_service.is_stale())
+    return response
+
+
+@router.get("/healthz", operation_id="healthz", response_model=HealthStatus)
+async def healthz() -> HealthStatus:
+    return HealthStatus(status="ok")
+
+
+@router.get(
+    "/readyz",
+    operation_id="readyz",
+    response_model=HealthStatus,
+    responses={
+        503: {"model": KonovoApiError, "description": "Catalog not loaded yet"},
+    },
+)
+async def readyz(
     product_service: ProductService = Depends(get_product_service),
-) -> Product:
-    return await product_service.get_product_by_id(jwt=jwt, product_id=product_id)
+    refresher: CatalogRefresher | None = Depends(get_catalog_refresher),
+) -> HealthStatus:
+    if not product_service.is_ready(eager=refresher is not None):
+        raise UnavailableError(
+            code="catalog_not_loaded",
+            message="Catalog is not loaded yet",
+            detail="Please try again later",
+        )
+    catalog = product_service.catalog
+    return HealthStatus(
+        status="ready",
+        catalog_version=catalog.version if catalog else None,
+        catalog_age=catalog.age(time.monotonic()) if catalog else None,
+    )
+
+
+@router.get(
+    "/metrics",
+    operation_id="metrics",
+    response_class=PlainTextResponse,
+    responses={
+        404: {"model": KonovoApiError, "description": "Metrics are disabled"},
+    },
+)
+async def get_metrics_text(metrics: Metrics = Depends(get_metrics)) -> Response:
+    if not metrics.enabled:
+        raise NotFoundError(
+            code="metrics_disabled",
+            message="Metrics are disabled",
+            detail="Set KONOVO_METRICS to enable them",
+        )
+    return PlainTextResponse(
+        metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
@@ -0,0 +1,72 @@
+import unicodedata
+from array import array
+from collections.abc import Iterable, Sequence
+
+# letters that do not decompose into a base letter and a combining mark
+FOLD_TABLE = str.maketrans({"đ": "dj", "ø": "o", "ł": "l", "ß": "ss", "æ": "ae"})
+
+NGRAM_SIZE = 3
+
+
+def fold(text: str, diacritics: bool = True) -> str:
+    """Normalizes text for case (and optionally diacritic) insensitive matching,
+    without diacritic folding as `str.lower`, e.g. "ß" stays as it is"""
+    if not diacritics:
+        return text.lower()
+    text = text.casefold()
+    if text.isascii():
+        return text
+    text = unicodedata.normalize("NFKD", text.translate(FOLD_TABLE))
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+
+def ngrams(text: str) -> set[str]:
+    return {text[i : i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)}
+
+
+class SearchIndex:
+    """Substring search over one text field of the catalog.
+
+    Texts are folded once and indexed by trigram, a query intersects the
+    posting lists of its trigrams and verifies the remaining candidates.
+    """
+
+    def __init__(self, texts: Iterable[str | None], fold_diacritics: bool = True):
+        self.fold_diacritics = fold_diacritics
+        self.texts = [fold(text or "", diacritics=fold_diacritics) for text in texts]
+        postings: dict[str, list[int]] = {}
+        for pos, text in enumerate(self.texts):
+            for gram in ngrams(text):
+                postings.setdefault(gram, []).append(pos)
+        self.postings = {gram: array("I", p) for gram, p in postings.items()}
+
+    def candidates(self, needle: str) -> Sequence[int] | None:
+        """Positions that contain every trigram of the needle, None when the
+        needle is too short to use the index"""
+        grams = ngrams(needle)
+        if not grams:
+            return None
+        lists = sorted((self.postings.get(gram, ()) for gram in grams), key=len)
+        if not lists[0]:
+            return ()
+        matched = set(lists[0])
+        for posting in lists[1:]:
+            matched.intersection_update(posting)
+            if not matched:
+                break
+        return sorted(matched)
+
+    def search(self, needle: str, positions: Sequence[int] | None = None) -> list[int]:
+        """Ascending positions whose text contains the needle, restricted to
+        `positions` (ascending) when given"""
+        needle = fold(needle, diacritics=self.fold_diacritics)
+        texts = self.texts
+        candidates = self.candidates(needle)
+        if candidates is None:
+            candidates = range(len(texts)) if positions is None else positions
+        elif positions is not None and len(positions) < len(candidates):
+            candidates = positions
+        elif positions is not None:
+            allowed = set(positions)
+            candidates = [pos for pos in candidates if pos in allowed]
+        return [pos for pos in candidates if needle in texts[pos]]
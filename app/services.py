@@ -1,35 +1,134 @@
-import re
+import asyncio
+import hashlib
+import heapq
+import time
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter
+from collections.abc import Sequence
+from contextlib import ExitStack
 
 import httpx
 from fastapi import status
-from pydantic import TypeAdapter
 
+from app.cache import CachedResponse, ResponseCache
+from app.catalog import Catalog, CatalogBuilder, Postings, build_catalog_json
+from app.conditional import NotModified, etag_matches, make_etag
+from app.config import AuthConfig, CatalogConfig, OffloadConfig, UpstreamConfig
+from app.export import ExportFormat, ProductExport
+from app.ingest import digest_chunks, stream_products
+from app.metrics import Metrics
 from app.models import (
+    FacetValue,
     LoginRequest,
     PaginatedProducts,
     Pagination,
     PaginationFilters,
+    PriceBucket,
     Product,
+    ProductBatch,
+    ProductFacets,
     ProductFilters,
     TokenResponse,
 )
+from app.offload import WorkerPool
+from app.pagination import decode_cursor, encode_cursor, invalid_cursor_error
+from app.plan import FilterPlan
+from app.processing import DEFAULT_PRODUCT_TRANSFORMS, ProductTransform
+from app.query import SortOrder, filters_key, query_key
+from app.singleflight import SingleFlight
+from app.snapshot import SharedSnapshot
+from app.tokens import TokenCache
+from app.upstream import CircuitBreaker, backoff, is_retryable
 
-from .errors import AuthenticationError, NotFoundError, UnavailableError
+from .errors import (
+    AuthenticationError,
+    BadRequestError,
+    KonovoError,
+    NotFoundError,
+    ServerBusyError,
+    TimeOutError,
+    UnavailableError,
+)
 
 KONOVO_BASE_URL = "https://zadatak.konovo.rs"
 KONOVO_LOGIN_PATH = "/login"
 KONOVO_PRODUCTS_PATH = "/products"
 
+# ids a single batch lookup may ask for
+MAX_BATCH_IDS = 100
+
+# partial sorts pay off while the page is small relative to the matches
+TOP_K_RATIO = 4
+
+
+def upstream_timeout_error() -> TimeOutError:
+    return TimeOutError(
+        code="upstream_timeout",
+        message="External service did not respond in time",
+        detail="Please try again later",
+    )
+
+
+def upstream_unavailable_error() -> UnavailableError:
+    return UnavailableError(
+        code="service_unavailable",
+        message="External service unavailable right now",
+        detail="Please try again later",
+    )
+
 
 class AuthService:
-    def __init__(self, client: httpx.AsyncClient):
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        upstream: UpstreamConfig | None = None,
+        config: AuthConfig | None = None,
+        metrics: Metrics | None = None,
+    ):
         self.client = client
+        self.upstream = upstream or UpstreamConfig()
+        self.config = config or AuthConfig()
+        self.metrics = metrics or Metrics(enabled=False)
+        self.tokens = TokenCache(
+            max_entries=self.config.token_cache_entries,
+            refresh_margin=self.config.token_refresh_margin,
+        )
+        self.flights: SingleFlight[TokenResponse] = SingleFlight()
+        self.coalesced = 0
 
     async def login(self, login_req: LoginRequest) -> TokenResponse:
+        """Upstream token for the credentials, cached until shortly before it
+        expires. Concurrent logins with the same credentials share one upstream
+        call, failed logins are not cached"""
+        key = self.tokens.key(login_req)
+        token = self.tokens.get(key)
+        if token is not None:
+            return token
+        if self.flights.in_flight(key):
+            self.coalesced += 1
+        return await self.flights.do(key, lambda: self.login_and_cache(login_req, key))
+
+    async def login_and_cache(self, login_req: LoginRequest, key: str) -> TokenResponse:
+        token = await self.login_upstream(login_req)
+        self.tokens.put(key, token)
+        return token
+
+    def forget(self, login_req: LoginRequest) -> None:
+        """Drops the cached token, e.g. when the upstream rejected it early"""
+        self.tokens.discard(self.tokens.key(login_req))
+
+    def stats(self) -> dict[str, int]:
+        return {**self.tokens.stats(), "coalesced": self.coalesced}
+
+    async def login_upstream(self, login_req: LoginRequest) -> TokenResponse:
         try:
-            res = await self.client.post(
-                url=KONOVO_LOGIN_PATH, json=login_req.model_dump()
-            )
+            with self.metrics.stage("login"):
+                res = await self.client.post(
+                    url=KONOVO_LOGIN_PATH,
+                    json=login_req.model_dump(),
+                    timeout=self.upstream.timeout(self.upstream.login_timeout),
+                )
             res.raise_for_status()
             token_resp = TokenResponse.model_validate(res.json())
             return token_resp
@@ -40,186 +139,499 @@ class AuthService:
                     message="Not authenticated",
                     detail="Invalid credentials",
                 )
+        except httpx.TimeoutException:
+            raise upstream_timeout_error()
         except httpx.RequestError:
-            raise UnavailableError(
-                code="service_unavailable",
-                message="External service unavailable right now",
-                detail="Please try again later",
-            )
+            raise upstream_unavailable_error()
         raise
 
 
 class ProductService:
-    def __init__(self, client: httpx.AsyncClient):
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        config: CatalogConfig | None = None,
+        transforms: Sequence[ProductTransform] = DEFAULT_PRODUCT_TRANSFORMS,
+        upstream: UpstreamConfig | None = None,
+        metrics: Metrics | None = None,
+        offload: OffloadConfig | None = None,
+    ):
         self.client = client
+        self.config = config or CatalogConfig()
+        self.upstream = upstream or UpstreamConfig()
+        self.metrics = metrics or Metrics(enabled=False)
+        self.offload = offload or OffloadConfig()
+        self.catalog_pool = WorkerPool(
+            self.offload.catalog_executor,
+            workers=self.offload.workers,
+            queue=self.offload.queue,
+            name="catalog",
+        )
+        self.query_pool = WorkerPool(
+            self.offload.query_executor,
+            workers=self.offload.workers,
+            queue=self.offload.queue,
+            name="query",
+        )
+        self.shared = (
+            SharedSnapshot(self.config.snapshot_dir)
+            if self.config.snapshot_dir
+            else None
+        )
+        self.breaker = CircuitBreaker(
+            max_failures=self.upstream.breaker_failures,
+            reset_timeout=self.upstream.breaker_reset,
+        )
+        self.transforms = transforms
+        self.catalog: Catalog | None = None
+        self.verified_tokens: dict[str, float] = {}
+        self.refresh_task: asyncio.Task[None] | None = None
+        self.flights: SingleFlight[Catalog] = SingleFlight()
+        self.response_cache = ResponseCache(
+            max_entries=self.config.response_cache_entries,
+            max_bytes=self.config.response_cache_bytes,
+        )
 
     def auth_headers(self, jwt: str) -> dict[str, str]:
         return {"Authorization": f"Bearer {jwt}"}
 
-    def adjust_product_price_for_monitors(self, prod: Product) -> Product:
-        if prod.categoryName == "Monitori":
-            prod.price = round(prod.price * 1.1, 2)
-        return prod
+    async def build_catalog(
+        self, content: bytes, version: str, res: httpx.Response
+    ) -> Catalog:
+        """Validates and indexes the catalog in the catalog worker pool"""
+        catalog, timings = await self.catalog_pool.run(
+            build_catalog_json,
+            content,
+            self.transforms,
+            version=version,
+            fetched_at=time.monotonic(),
+            etag=res.headers.get("ETag"),
+            last_modified=res.headers.get("Last-Modified"),
+        )
+        for stage, seconds in timings.items():
+            self.metrics.observe_stage(stage, seconds)
+        return catalog
 
-    def adjust_product_description(self, prod: Product) -> Product:
-        if prod.description:
-            prod.description = re.sub(
-                r"brzina", "performanse", prod.description, flags=re.I
-            )
-        return prod
+    def catalog_request_headers(self, jwt: str) -> dict[str, str]:
+        headers = self.auth_headers(jwt)
+        if self.catalog and self.catalog.etag:
+            headers["If-None-Match"] = self.catalog.etag
+        if self.catalog and self.catalog.last_modified:
+            headers["If-Modified-Since"] = self.catalog.last_modified
+        return headers
 
-    def process_product(self, product: Product) -> Product:
-        product = self.adjust_product_price_for_monitors(product)
-        product = self.adjust_product_description(product)
-        return product
+    def unchanged_catalog(
+        self, res: httpx.Response, version: str | None
+    ) -> Catalog | None:
+        """The current catalog, re-confirmed, when the upstream content did not
+        change (304 to a conditional request or the same content hash)"""
+        if self.catalog is None:
+            return None
+        not_modified = res.status_code == status.HTTP_304_NOT_MODIFIED
+        if not_modified or version == self.catalog.version:
+            return self.catalog.refreshed(
+                fetched_at=time.monotonic(),
+                etag=res.headers.get("ETag"),
+                last_modified=res.headers.get("Last-Modified"),
+            )
+        return None
 
-    async def fetch_products(self, jwt: str) -> list[Product]:
-        try:
+    async def download_catalog(self, jwt: str) -> Catalog:
+        with self.metrics.stage("upstream"):
             res = await self.client.get(
-                url=KONOVO_PRODUCTS_PATH, headers=self.auth_headers(jwt)
+                url=KONOVO_PRODUCTS_PATH,
+                headers=self.catalog_request_headers(jwt),
+                timeout=self.upstream.timeout(self.upstream.catalog_timeout),
             )
+        if catalog := self.unchanged_catalog(res, version=None):
+            return catalog
+        res.raise_for_status()
+        version = hashlib.sha256(res.content).hexdigest()[:32]
+        if catalog := self.unchanged_catalog(res, version=version):
+            return catalog
+        return await self.build_catalog(res.content, version, res)
+
+    async def stream_catalog(self, jwt: str) -> Catalog:
+        with self.metrics.stage("upstream"):
+            return await self.stream_and_build_catalog(jwt=jwt)
+
+    async def stream_and_build_catalog(self, jwt: str) -> Catalog:
+        # validation and processing overlap the download, they are not timed
+        # as stages of their own
+        async with self.client.stream(
+            "GET",
+            url=KONOVO_PRODUCTS_PATH,
+            headers=self.catalog_request_headers(jwt),
+            timeout=self.upstream.timeout(self.upstream.catalog_timeout),
+        ) as res:
+            if catalog := self.unchanged_catalog(res, version=None):
+                return catalog
             res.raise_for_status()
-            products = TypeAdapter(list[Product]).validate_python(res.json())
-            return products
+            digest = hashlib.sha256()
+            builder = CatalogBuilder(self.transforms)
+            async for product in stream_products(
+                digest_chunks(res.aiter_bytes(), digest)
+            ):
+                builder.append(product)
+        if catalog := self.unchanged_catalog(res, version=digest.hexdigest()[:32]):
+            return catalog
+        return builder.build(
+            version=digest.hexdigest()[:32],
+            fetched_at=time.monotonic(),
+            etag=res.headers.get("ETag"),
+            last_modified=res.headers.get("Last-Modified"),
+        )
+
+    async def fetch_catalog_with_retries(self, jwt: str) -> Catalog:
+        """GETs are idempotent, failures of the upstream are retried"""
+        attempt = 0
+        while True:
+            try:
+                if self.config.stream_ingest:
+                    return await self.stream_catalog(jwt=jwt)
+                return await self.download_catalog(jwt=jwt)
+            except httpx.HTTPError as e:
+                if attempt >= self.upstream.retries or not is_retryable(e):
+                    raise
+                attempt += 1
+                await asyncio.sleep(
+                    backoff(
+                        attempt,
+                        base=self.upstream.retry_backoff,
+                        cap=self.upstream.retry_max_backoff,
+                    )
+                )
+
+    async def fetch_catalog(self, jwt: str) -> Catalog:
+        if not self.breaker.allow():
+            # fail fast instead of queueing on an upstream that keeps failing
+            raise upstream_unavailable_error()
+        try:
+            catalog = await self.fetch_catalog_with_retries(jwt=jwt)
         except httpx.HTTPStatusError as e:
+            if is_retryable(e):
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
             if e.response.status_code == status.HTTP_401_UNAUTHORIZED:
                 raise AuthenticationError(
                     code="auth_token_invalid",
                     message="Not authenticated",
                     detail="Token is missing or is invalid",
                 )
+            if is_retryable(e):
+                raise upstream_unavailable_error()
+            raise
+        except httpx.TimeoutException:
+            self.breaker.record_failure()
+            raise upstream_timeout_error()
         except httpx.RequestError:
-            raise UnavailableError(
-                code="service_unavailable",
-                message="External service unavailable right now",
-                detail="Please try again later",
+            self.breaker.record_failure()
+            raise upstream_unavailable_error()
+        except ServerBusyError:
+            # the catalog pool rejected the build, the upstream answered
+            self.breaker.record_unknown()
+            raise
+        except ValueError:
+            # the upstream answered with something that is no valid catalog
+            self.breaker.record_failure()
+            raise
+        except BaseException:
+            # other local failures, e.g. a disconnected client
+            self.breaker.record_unknown()
+            raise
+        self.breaker.record_success()
+        return catalog
+
+    def token_key(self, jwt: str) -> str:
+        return hashlib.sha256(jwt.encode()).hexdigest()
+
+    def is_token_verified(self, jwt: str, now: float) -> bool:
+        return self.verified_tokens.get(self.token_key(jwt), 0.0) > now
+
+    def was_token_verified(self, jwt: str, now: float) -> bool:
+        """Whether the upstream verified the token within the last max_stale
+        seconds, such tokens are served while it cannot verify them again"""
+        until = self.verified_tokens.get(self.token_key(jwt))
+        return until is not None and until + self.config.max_stale > now
+
+    async def persist_tokens(self, updates: dict[str, float | None]) -> None:
+        """Records verified (or rejected, None) tokens next to the snapshot, so
+        that they are still served when the upstream is down after a restart"""
+        if self.shared is None:
+            return
+        # wall clock times, the monotonic clock restarts with the process
+        offset = time.time() - time.monotonic()
+        updates = {
+            key: None if until is None else until + offset
+            for key, until in updates.items()
+        }
+        try:
+            await asyncio.to_thread(
+                self.shared.update_tokens, updates, keep=self.config.max_stale
             )
-        raise
+        except (OSError, ValueError):
+            # log error here etc... only a restart during an outage needs them
+            pass
+
+    async def share_catalog(self, catalog: Catalog) -> Catalog:
+        """Publishes a downloaded catalog to the other workers, the published
+        catalog is then read from the shared file like theirs"""
+        if self.shared is None:
+            return catalog
+        try:
+            if self.catalog is not None and catalog.version == self.catalog.version:
+                await asyncio.to_thread(self.shared.touch)
+                return catalog
+            return await asyncio.to_thread(self.shared.publish, catalog)
+        except OSError:
+            # log error here etc... e.g. a full disk, this worker keeps the
+            # catalog in its own memory
+            return catalog
+
+    async def sync_shared(self) -> None:
+        """Switches to a snapshot another worker published"""
+        if self.shared is None:
+            return
+        try:
+            if not self.shared.changed():
+                return
+            catalog = await asyncio.to_thread(self.shared.load, self.catalog)
+        except (OSError, ValueError):
+            # log error here etc... e.g. a corrupt file, the next publish fixes it
+            return
+        if catalog is None:
+            return
+        if self.catalog is None or catalog.fetched_at > self.catalog.fetched_at:
+            self.catalog = catalog
 
-    def filter_products_by_brand_ids(
-        self, products: list[Product], brand_ids: list[str]
-    ) -> list[Product]:
-        ids = (
-            [id.strip() for id in brand_ids[0].split(",") if id.strip()]
-            if len(brand_ids) == 1
-            else brand_ids
+    async def load_catalog(self, jwt: str) -> Catalog:
+        key = self.token_key(jwt)
+        try:
+            catalog = await self.share_catalog(await self.fetch_catalog(jwt=jwt))
+        except AuthenticationError:
+            if self.verified_tokens.pop(key, None) is not None:
+                await self.persist_tokens({key: None})
+            raise
+        self.catalog = catalog
+        now = time.monotonic()
+        # expired verifications are kept for max_stale, see `was_token_verified`
+        self.verified_tokens = {
+            token: until
+            for token, until in self.verified_tokens.items()
+            if until + self.config.max_stale > now
+        }
+        self.verified_tokens[key] = now + self.config.token_ttl
+        await self.persist_tokens({key: self.verified_tokens[key]})
+        return catalog
+
+    async def verify_and_load_catalog(self, jwt: str) -> Catalog:
+        """Loads the catalog with the token. Concurrent callers share one
+        download whatever their token, those it was not made with are then
+        confirmed with a conditional request, a 304 while nothing changed"""
+        for _ in range(2):
+            joined = self.flights.in_flight(KONOVO_PRODUCTS_PATH)
+            try:
+                catalog = await self.reload_catalog(jwt=jwt)
+            except AuthenticationError:
+                if not joined:
+                    raise
+                # the shared load was made with another token, which was
+                # rejected, the next one may be made with this one
+                continue
+            if self.is_token_verified(jwt, time.monotonic()):
+                return catalog
+            break
+        return await self.flights.do(
+            self.token_key(jwt), lambda: self.load_catalog(jwt=jwt)
         )
-        return [p for p in products if p.sif_productbrand and p.sif_productbrand in ids]
 
-    def filter_products_by_category_ids(
-        self, products: list[Product], category_ids: list[str]
-    ) -> list[Product]:
-        ids = (
-            [id.strip() for id in category_ids[0].split(",") if id.strip()]
-            if len(category_ids) == 1
-            else category_ids
+    async def reload_catalog(self, jwt: str) -> Catalog:
+        return await self.flights.do(
+            KONOVO_PRODUCTS_PATH, lambda: self.load_catalog(jwt=jwt)
         )
-        return [
-            p
-            for p in products
-            if p.sif_productcategory and p.sif_productcategory in ids
-        ]
 
-    def filter_products_by_brand(
-        self, products: list[Product], brand: str
-    ) -> list[Product]:
-        return [p for p in products if brand.lower() in ((p.brandName or "").lower())]
+    def is_fresh(self) -> bool:
+        return (
+            self.catalog is not None
+            and self.catalog.age(time.monotonic()) < self.config.ttl
+        )
 
-    def filter_products_by_category(
-        self, products: list[Product], category: str
-    ) -> list[Product]:
-        return [
-            p for p in products if category.lower() in ((p.categoryName or "").lower())
-        ]
+    async def coordinated_reload(self, jwt: str) -> None:
+        """Reloads the catalog, with a shared snapshot only the worker holding
+        the refresh lock does so and the others pick up its snapshot later"""
+        if self.shared is None:
+            await self.reload_catalog(jwt=jwt)
+            return
+        await self.sync_shared()
+        if self.is_fresh():
+            return
+        with ExitStack() as stack:
+            try:
+                locked = stack.enter_context(self.shared.lock())
+            except OSError:
+                # log error here etc... without the lock file every worker
+                # reloads on its own
+                locked = True
+            if not locked:
+                return
+            # the previous lock holder may have just published
+            await self.sync_shared()
+            if not self.is_fresh():
+                await self.reload_catalog(jwt=jwt)
+
+    async def refresh_catalog(self, jwt: str) -> None:
+        try:
+            await self.coordinated_reload(jwt=jwt)
+        except KonovoError:
+            # log error here etc... the stale catalog keeps being served, a
+            # rejected token was already forgotten by `load_catalog`
+            pass
+
+    def schedule_refresh(self, jwt: str) -> None:
+        if self.refresh_task and not self.refresh_task.done():
+            return
+        if self.flights.in_flight(KONOVO_PRODUCTS_PATH):
+            return
+        self.refresh_task = asyncio.create_task(self.refresh_catalog(jwt=jwt))
 
-    def filter_products_by_name(
-        self, products: list[Product], name: str
-    ) -> list[Product]:
-        return [p for p in products if name.lower() in p.naziv.lower()]
+    async def get_catalog(self, jwt: str) -> Catalog:
+        """Returns the cached catalog, fetching it when missing, expired or when
+        the token was not yet verified against the upstream"""
+        now = time.monotonic()
+        catalog = self.catalog
+        if self.shared and (catalog is None or catalog.age(now) >= self.config.ttl):
+            await self.sync_shared()
+            catalog = self.catalog
+        if catalog is None or not self.is_token_verified(jwt, now):
+            try:
+                # also the time spent waiting on a load started by another request
+                with self.metrics.stage("catalog"):
+                    return await self.verify_and_load_catalog(jwt=jwt)
+            except (UnavailableError, TimeOutError):
+                if catalog is None or not self.was_token_verified(jwt, now):
+                    raise
+                # the upstream is down, e.g. right after a restart, the last
+                # snapshot is served to tokens it verified before
+                return catalog
+        age = catalog.age(now)
+        if age < self.config.ttl:
+            return catalog
+        if age < self.config.max_stale or self.breaker.is_open:
+            # while the upstream is down the last good snapshot is served, the
+            # refresh fails fast or is the trial call of the circuit breaker
+            self.schedule_refresh(jwt=jwt)
+            return catalog
+        with self.metrics.stage("catalog"):
+            return await self.reload_catalog(jwt=jwt)
 
-    def filter_products_by_price(
+    def is_stale(self) -> bool:
+        """Whether the served catalog was not confirmed by the upstream within
+        the ttl, e.g. it was restored from disk or the upstream is down"""
+        catalog = self.catalog
+        return catalog is not None and catalog.age(time.monotonic()) >= self.config.ttl
+
+    async def restore(self) -> None:
+        """Loads the snapshot and the verified tokens left on disk, so requests
+        are served before the first upstream fetch, and starts catalog worker
+        processes"""
+        self.catalog_pool.warm_up("app.catalog")
+        await self.sync_shared()
+        if self.shared is None:
+            return
+        try:
+            tokens = await asyncio.to_thread(self.shared.load_tokens)
+        except (OSError, ValueError):
+            return
+        offset = time.monotonic() - time.time()
+        for key, until in tokens.items():
+            self.verified_tokens.setdefault(key, until + offset)
+
+    def is_ready(self, eager: bool) -> bool:
+        """Whether requests can be served without waiting for the upstream, a
+        lazily loaded catalog is always ready"""
+        return not eager or self.catalog is not None
+
+    async def aclose(self) -> None:
+        if self.refresh_task and not self.refresh_task.done():
+            self.refresh_task.cancel()
+            try:
+                await self.refresh_task
+            except asyncio.CancelledError:
+                pass
+        self.catalog_pool.shutdown()
+        self.query_pool.shutdown()
+
+    def sort_products(
         self,
-        products: list[Product],
-        price_lt: float | None,
-        price_lte: float | None,
-        price_gt: float | None,
-        price_gte: float | None,
-    ) -> list[Product]:
-        min_price = price_gte or price_gt
-        max_price = price_lte or price_lt
-        if min_price:
-            if (price_gt and price_gte) or (price_gte):
-                products = [p for p in products if p.price >= min_price]
-            elif price_gt:
-                products = [p for p in products if p.price > min_price]
-        if max_price:
-            if (price_lt and price_lte) or (price_lte):
-                products = [p for p in products if p.price <= max_price]
-            elif price_lt:
-                products = [p for p in products if p.price < max_price]
-        return products
-
-    def sort_products(self, products: list[Product], sort: str) -> list[Product]:
-        sort_by = sort.lstrip("-")
-        descending = sort.startswith("-")
-        if sort_by == "price":
-            products.sort(key=lambda p: p.price, reverse=descending)
-        return products
+        catalog: Catalog,
+        positions: list[int],
+        order: SortOrder,
+        limit: int | None = None,
+    ) -> list[int]:
+        """Orders positions, only the first `limit` are guaranteed to be returned"""
+        if not order:
+            return positions
+        if len(order.fields) == 1 and order.fields[0][0] == "price":
+            # walking the precomputed price order beats sorting large subsets
+            if limit is None or limit * TOP_K_RATIO >= len(positions):
+                return catalog.index.sort_by_price(
+                    positions, descending=order.fields[0][1]
+                )
+        key = order.sort_key(catalog)
+        if limit is not None and limit * TOP_K_RATIO < len(positions):
+            # O(n log k) partial sort, the keys are unique so ties cannot reorder
+            return heapq.nsmallest(limit, positions, key=key)
+        return sorted(positions, key=key)
 
     def paginate_products(
         self,
-        products: list[Product],
+        catalog: Catalog,
+        positions: list[int],
+        sort: str | None,
         pagination: PaginationFilters,
     ) -> PaginatedProducts:
-        total = len(products)
-        page = max(1, pagination.page or 1)
+        order = SortOrder(sort)
+        total = len(positions)
         page_size = max(1, pagination.page_size or total)
-        start = (page - 1) * page_size
-        end = start + (page_size or total)
+        if pagination.cursor:
+            cursor = decode_cursor(pagination.cursor)
+            if cursor.sort != str(order):
+                raise invalid_cursor_error(
+                    "The cursor belongs to a different sort order"
+                )
+            after = order.after(catalog, cursor)
+            key = order.sort_key(catalog)
+            positions = [pos for pos in positions if key(pos) > after]
+            page = (total - len(positions)) // page_size + 1
+            start = 0
+        else:
+            page = max(1, pagination.page or 1)
+            start = (page - 1) * page_size
+        end = start + page_size
+        ordered = self.sort_products(catalog, positions, order=order, limit=end)
+        selected = ordered[start:end]
+        next_cursor = (
+            encode_cursor(order.cursor(catalog, selected[-1]))
+            if selected and end < len(positions)
+            else None
+        )
         paginated = PaginatedProducts(
-            products=products[start:end],
-            meta=Pagination(page=page, page_size=page_size, total=total),
+            products=catalog.take(selected),
+            meta=Pagination(
+                page=page, page_size=page_size, total=total, next_cursor=next_cursor
+            ),
         )
         return paginated
 
     def filter_products(
         self,
-        products: list[Product],
+        catalog: Catalog,
         filters: ProductFilters,
-    ) -> list[Product]:
-        if filters.category_ids:
-            products = self.filter_products_by_category_ids(
-                products=products, category_ids=filters.category_ids
-            )
-        if filters.brand_ids:
-            products = self.filter_products_by_brand_ids(
-                products=products, brand_ids=filters.brand_ids
-            )
-        if not filters.category_ids and filters.category:
-            products = self.filter_products_by_category(
-                products=products, category=filters.category
-            )
-        if not filters.brand_ids and filters.brand:
-            products = self.filter_products_by_brand(
-                products=products, brand=filters.brand
-            )
-        if filters.name:
-            products = self.filter_products_by_name(
-                products=products, name=filters.name
-            )
-        if any(
-            [filters.price_lt, filters.price_lte, filters.price_gt, filters.price_gte]
-        ):
-            products = self.filter_products_by_price(
-                products=products,
-                price_lt=filters.price_lt,
-                price_lte=filters.price_lte,
-                price_gt=filters.price_gt,
-                price_gte=filters.price_gte,
-            )
-        if filters.sort:
-            products = self.sort_products(products=products, sort=filters.sort)
-        return products
+    ) -> list[int]:
+        """Positions of the matching products, in catalog order"""
+        plan = FilterPlan(filters, fold_diacritics=self.config.search_fold_diacritics)
+        return plan.execute(catalog)
 
     async def list_products(
         self,
@@ -227,19 +639,238 @@ class ProductService:
         filters: ProductFilters,
         pagination: PaginationFilters,
     ) -> PaginatedProducts:
-        products = await self.fetch_products(jwt=jwt)
-        filtered = self.filter_products(products, filters=filters)
-        processed = [self.process_product(p) for p in filtered]
-        paginated = self.paginate_products(processed, pagination)
+        catalog = await self.get_catalog(jwt=jwt)
+        positions = self.filter_products(catalog, filters=filters)
+        paginated = self.paginate_products(
+            catalog, positions, sort=filters.sort, pagination=pagination
+        )
         return paginated
 
-    async def get_product_by_id(self, jwt: str, product_id: int) -> Product:
-        products = await self.fetch_products(jwt=jwt)
-        for p in products:
-            if p.sif_product == str(product_id):
-                return self.process_product(p)
+    async def list_products_page(
+        self,
+        jwt: str,
+        filters: ProductFilters,
+        pagination: PaginationFilters,
+        if_none_match: str | None = None,
+    ) -> CachedResponse | NotModified:
+        """Serialized `list_products` response, cached per catalog version"""
+        catalog = await self.get_catalog(jwt=jwt)
+        key = query_key(
+            filters, pagination, fold_diacritics=self.config.search_fold_diacritics
+        )
+        etag = make_etag(catalog.version, repr(key))
+        if etag_matches(if_none_match, etag):
+            return NotModified(etag)
+        page = self.response_cache.get(catalog.version, key)
+        if page is None:
+            page = await self.query_pool.run(
+                self.render_page, catalog, filters, pagination, etag
+            )
+            self.response_cache.put(catalog.version, key, page)
+        return page
+
+    def render_page(
+        self,
+        catalog: Catalog,
+        filters: ProductFilters,
+        pagination: PaginationFilters,
+        etag: str,
+    ) -> CachedResponse:
+        with self.metrics.stage("filter"):
+            positions = self.filter_products(catalog, filters=filters)
+        with self.metrics.stage("paginate"):
+            paginated = self.paginate_products(
+                catalog, positions, sort=filters.sort, pagination=pagination
+            )
+        with self.metrics.stage("serialize"):
+            body = paginated.model_dump_json().encode()
+        return CachedResponse(body=body, etag=etag, meta=paginated.meta)
+
+    async def export_products(
+        self,
+        jwt: str,
+        filters: ProductFilters,
+        format: ExportFormat,
+        if_none_match: str | None = None,
+    ) -> ProductExport | NotModified:
+        """All filtered products, serialized while the response is streamed"""
+        catalog = await self.get_catalog(jwt=jwt)
+        key = (
+            "export",
+            format,
+            filters_key(filters, fold_diacritics=self.config.search_fold_diacritics),
+            str(SortOrder(filters.sort)),
+        )
+        etag = make_etag(catalog.version, repr(key))
+        if etag_matches(if_none_match, etag):
+            return NotModified(etag)
+        positions = await self.query_pool.run(self.export_positions, catalog, filters)
+        return ProductExport(catalog, positions=positions, format=format, etag=etag)
+
+    def export_positions(self, catalog: Catalog, filters: ProductFilters) -> array:
+        with self.metrics.stage("filter"):
+            positions = self.filter_products(catalog, filters=filters)
+        with self.metrics.stage("sort"):
+            positions = self.sort_products(catalog, positions, SortOrder(filters.sort))
+        return array("I", positions)
+
+    def count_values(
+        self,
+        catalog: Catalog,
+        positions: list[int],
+        id_field: str,
+        name_field: str,
+        postings: Postings,
+    ) -> list[FacetValue]:
+        """Products per id, most frequent first"""
+        column = catalog.source.category_column(id_field)
+        if len(positions) == len(catalog):
+            counts = Counter(column.codes)
+        else:
+            counts = Counter(map(column.codes.__getitem__, positions))
+        names = catalog.source.column(name_field)
+        values = [
+            # the name of the first product with the id
+            FacetValue(id=id, name=names[postings[id][0]], count=count)
+            for code, count in counts.items()
+            if (id := column.values[code])
+        ]
+        values.sort(key=lambda value: -value.count)
+        return values
+
+    def count_prices(
+        self, catalog: Catalog, positions: list[int], bounds: list[float]
+    ) -> list[PriceBucket]:
+        """Products per price bucket, the buckets lie between the bounds"""
+        if len(positions) == len(catalog):
+            # bucket edges in the sorted prices of the whole catalog
+            sorted_prices = catalog.index.sorted_prices
+            ends = [bisect_left(sorted_prices, bound) for bound in bounds]
+            ends = [0, *ends, len(sorted_prices)]
+            counts = {i: ends[i + 1] - ends[i] for i in range(len(bounds) + 1)}
+        else:
+            prices = catalog.index.prices
+            counts = Counter(bisect_right(bounds, prices[pos]) for pos in positions)
+        edges = [None, *bounds, None]
+        return [
+            PriceBucket(min=edges[i], max=edges[i + 1], count=counts[i])
+            for i in range(len(bounds) + 1)
+        ]
+
+    def count_facets(self, catalog: Catalog, positions: list[int]) -> ProductFacets:
+        return ProductFacets(
+            total=len(positions),
+            brands=self.count_values(
+                catalog,
+                positions,
+                "sif_productbrand",
+                "brandName",
+                postings=catalog.index.by_brand_id,
+            ),
+            categories=self.count_values(
+                catalog,
+                positions,
+                "sif_productcategory",
+                "categoryName",
+                postings=catalog.index.by_category_id,
+            ),
+            prices=self.count_prices(
+                catalog, positions, bounds=self.config.facet_price_buckets
+            ),
+        )
+
+    async def get_facets_response(
+        self, jwt: str, filters: ProductFilters, if_none_match: str | None = None
+    ) -> CachedResponse | NotModified:
+        """Serialized facet counts of the filtered products, cached per catalog
+        version like `list_products_page`"""
+        catalog = await self.get_catalog(jwt=jwt)
+        key = (
+            "facets",
+            filters_key(filters, fold_diacritics=self.config.search_fold_diacritics),
+        )
+        etag = make_etag(catalog.version, repr(key))
+        if etag_matches(if_none_match, etag):
+            return NotModified(etag)
+        cached = self.response_cache.get(catalog.version, key)
+        if cached is None:
+            cached = await self.query_pool.run(
+                self.render_facets, catalog, filters, etag
+            )
+            self.response_cache.put(catalog.version, key, cached)
+        return cached
+
+    def render_facets(
+        self, catalog: Catalog, filters: ProductFilters, etag: str
+    ) -> CachedResponse:
+        with self.metrics.stage("filter"):
+            positions = self.filter_products(catalog, filters=filters)
+        with self.metrics.stage("facets"):
+            facets = self.count_facets(catalog, positions)
+        with self.metrics.stage("serialize"):
+            body = facets.model_dump_json().encode()
+        return CachedResponse(body=body, etag=etag)
+
+    def find_product(self, catalog: Catalog, product_id: int) -> Product:
+        product = catalog.get(str(product_id))
+        if product is not None:
+            return product
         raise NotFoundError(
             code="product_not_found",
             message="Product no found",
             detail=f"Product with id: {product_id} does not exist",
         )
+
+    async def get_product_by_id(self, jwt: str, product_id: int) -> Product:
+        catalog = await self.get_catalog(jwt=jwt)
+        return self.find_product(catalog, product_id)
+
+    def find_products(self, catalog: Catalog, ids: list[str]) -> ProductBatch:
+        """Products in the order of `ids`, repeated ids are returned once"""
+        if len(ids) > MAX_BATCH_IDS:
+            raise BadRequestError(
+                code="too_many_ids",
+                message="Too many product ids",
+                detail=f"At most {MAX_BATCH_IDS} products can be looked up at once",
+            )
+        products: list[Product] = []
+        missing: list[str] = []
+        for id in dict.fromkeys(ids):
+            product = catalog.get(id)
+            if product is None:
+                missing.append(id)
+            else:
+                products.append(product)
+        return ProductBatch(products=products, missing=missing)
+
+    async def get_products_response(
+        self, jwt: str, ids: list[str], if_none_match: str | None = None
+    ) -> CachedResponse | NotModified:
+        """Serialized batch of products, with a content hash etag like
+        `get_product_response`"""
+        catalog = await self.get_catalog(jwt=jwt)
+        batch = self.find_products(catalog, ids)
+        with self.metrics.stage("serialize"):
+            body = batch.model_dump_json().encode()
+        etag = make_etag(body)
+        if etag_matches(if_none_match, etag):
+            return NotModified(etag)
+        return CachedResponse(body=body, etag=etag)
+
+    async def get_product_response(
+        self, jwt: str, product_id: int, if_none_match: str | None = None
+    ) -> CachedResponse | NotModified:
+        """Serialized product, its etag is a hash of the content so it survives
+        catalog refreshes that do not change the product"""
+        catalog = await self.get_catalog(jwt=jwt)
+        key = ("product", product_id)
+        cached = self.response_cache.get(catalog.version, key)
+        if cached is None:
+            product = self.find_product(catalog, product_id)
+            with self.metrics.stage("serialize"):
+                body = product.model_dump_json().encode()
+            cached = CachedResponse(body=body, etag=make_etag(body))
+            self.response_cache.put(catalog.version, key, cached)
+        if etag_matches(if_none_match, cached.etag):
+            return NotModified(cached.etag)
+        return cached
@@ -0,0 +1,32 @@
+import asyncio
+from collections.abc import Awaitable, Callable, Hashable
+
+
+class SingleFlight[T]:
+    """Coalesces concurrent calls for the same key into one in-flight call.
+
+    The call runs in its own task, so a waiter being cancelled (e.g. its client
+    disconnected) neither cancels the call for the other waiters nor discards
+    its result. Every waiter receives the same result or the same exception.
+    """
+
+    def __init__(self):
+        self.calls: dict[Hashable, asyncio.Task[T]] = {}
+
+    def in_flight(self, key: Hashable) -> bool:
+        return key in self.calls
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self.calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self.calls[key] = task
+            task.add_done_callback(lambda t: self.forget(key, t))
+        return await asyncio.shield(task)
+
+    def forget(self, key: Hashable, task: asyncio.Task[T]) -> None:
+        if self.calls.get(key) is task:
+            del self.calls[key]
+        if not task.cancelled():
+            # mark the exception as retrieved when every waiter went away
+            task.exception()
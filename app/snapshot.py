@@ -0,0 +1,352 @@
+import json
+import mmap
+import os
+import struct
+import tempfile
+import time
+from array import array
+from collections.abc import Generator
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any
+
+from app.catalog import Catalog, CatalogIndex, Postings, SortedIdIndex
+from app.store import (
+    Buffer,
+    CategoryColumn,
+    Column,
+    OverlayColumn,
+    ProductStore,
+    TextColumn,
+)
+
+# magic, wall clock time of the last upstream confirmation, metadata length
+HEADER = struct.Struct("<8sdQ")
+MAGIC = b"KONOVO02"
+FETCHED_AT_OFFSET = 8
+ALIGNMENT = 8
+
+
+def aligned(size: int) -> int:
+    return size + -size % ALIGNMENT
+
+
+class SectionWriter:
+    """Lays out binary sections one after the other, aligned for typed views"""
+
+    def __init__(self):
+        self.sections: list[Buffer | bytes] = []
+        self.size = 0
+
+    def add(self, data: Buffer | bytes) -> list[int]:
+        nbytes = memoryview(data).nbytes
+        section = [self.size, nbytes]
+        self.sections.append(data)
+        self.size = aligned(self.size + nbytes)
+        return section
+
+    def write(self, file: Any) -> None:
+        for data in self.sections:
+            nbytes = memoryview(data).nbytes
+            file.write(data)
+            file.write(b"\0" * (-nbytes % ALIGNMENT))
+
+
+def encode_column(column: Column, sections: SectionWriter) -> dict[str, Any]:
+    if isinstance(column, TextColumn):
+        return {
+            "kind": "text",
+            "data": sections.add(column.data),
+            "offsets": sections.add(column.offsets),
+            "nulls": None if column.nulls is None else sections.add(column.nulls),
+        }
+    if isinstance(column, CategoryColumn):
+        return {
+            "kind": "category",
+            "values": column.values,
+            "codes": sections.add(column.codes),
+        }
+    if isinstance(column, (array, memoryview)):
+        return {"kind": "number", "values": sections.add(column)}
+    raise TypeError(f"cannot store a {type(column).__name__} column")
+
+
+def encode_postings(postings: Postings, sections: SectionWriter) -> dict[str, Any]:
+    return {
+        "positions": sections.add(postings.positions),
+        "offsets": sections.add(postings.offsets),
+    }
+
+
+def write_snapshot(catalog: Catalog, path: Path, fetched_at: float) -> None:
+    """Writes the catalog with its id index, postings and price orders to
+    `path`, atomically replacing the previous snapshot. `fetched_at` is a wall
+    clock time"""
+    sections = SectionWriter()
+    by_id = catalog.index.by_id.sorted()
+    columns = {
+        field: encode_column(column, sections)
+        for field, column in catalog.source.columns.items()
+    }
+    overrides = {
+        field: list(column.overrides.items())
+        for field, column in catalog.served.columns.items()
+        if isinstance(column, OverlayColumn)
+    }
+    meta = {
+        "version": catalog.version,
+        "etag": catalog.etag,
+        "last_modified": catalog.last_modified,
+        "size": len(catalog),
+        "columns": columns,
+        "overrides": overrides,
+        "price_order": sections.add(catalog.index.price_order),
+        "price_order_desc": sections.add(catalog.index.price_order_desc),
+        "sorted_prices": sections.add(array("d", catalog.index.sorted_prices)),
+        "by_id": {
+            "ids": encode_column(by_id.ids, sections),
+            "positions": sections.add(by_id.positions),
+        },
+        "by_brand_id": encode_postings(catalog.index.by_brand_id, sections),
+        "by_category_id": encode_postings(catalog.index.by_category_id, sections),
+    }
+    encoded = json.dumps(meta).encode()
+    header = HEADER.pack(MAGIC, fetched_at, len(encoded))
+    with tempfile.NamedTemporaryFile(
+        dir=path.parent, prefix=f".{path.name}.", delete=False
+    ) as file:
+        try:
+            file.write(header)
+            file.write(encoded)
+            file.write(b"\0" * (aligned(len(header) + len(encoded)) - file.tell()))
+            sections.write(file)
+            file.flush()
+            os.fsync(file.fileno())
+        except BaseException:
+            os.unlink(file.name)
+            raise
+    os.replace(file.name, path)
+
+
+def replace_file(path: Path, data: bytes) -> None:
+    """Writes `data` to `path`, atomically replacing the previous file"""
+    with tempfile.NamedTemporaryFile(
+        dir=path.parent, prefix=f".{path.name}.", delete=False
+    ) as file:
+        try:
+            file.write(data)
+            file.flush()
+            os.fsync(file.fileno())
+        except BaseException:
+            os.unlink(file.name)
+            raise
+    os.replace(file.name, path)
+
+
+def read_header(buffer: Buffer | bytes) -> tuple[float, dict[str, Any], int]:
+    """Fetch time, metadata and the offset of the first section"""
+    magic, fetched_at, meta_size = HEADER.unpack_from(buffer)
+    if magic != MAGIC:
+        raise ValueError("not a catalog snapshot")
+    end = HEADER.size + meta_size
+    meta = json.loads(bytes(buffer[HEADER.size : end]))
+    return fetched_at, meta, aligned(end)
+
+
+def read_metadata(path: Path) -> tuple[float, dict[str, Any]]:
+    with open(path, "rb") as file:
+        header = file.read(HEADER.size)
+        meta_size = HEADER.unpack(header)[2]
+        fetched_at, meta, _ = read_header(header + file.read(meta_size))
+    return fetched_at, meta
+
+
+def monotonic_time(fetched_at: float) -> float:
+    """Wall clock time stored in a snapshot on this process' monotonic clock"""
+    return time.monotonic() - max(0.0, time.time() - fetched_at)
+
+
+def read_snapshot(path: Path) -> Catalog:
+    """Memory maps a snapshot written by `write_snapshot`, columns, the id
+    index, postings and price orders are read from the mapping instead of being
+    copied. Search indexes and sort ranks are still built per process on first
+    use"""
+    with open(path, "rb") as file:
+        mapping = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    buffer = memoryview(mapping)
+    fetched_at, meta, start = read_header(buffer)
+
+    def section(spec: list[int]) -> memoryview:
+        offset, nbytes = spec
+        return buffer[start + offset : start + offset + nbytes]
+
+    def ints(spec: list[int]) -> memoryview:
+        return section(spec).cast("I")
+
+    def floats(spec: list[int]) -> "memoryview[float]":
+        return section(spec).cast("d")
+
+    def read_column(spec: dict[str, Any]) -> Column:
+        if spec["kind"] == "text":
+            return TextColumn(
+                data=section(spec["data"]),
+                offsets=ints(spec["offsets"]),
+                nulls=None if spec["nulls"] is None else section(spec["nulls"]),
+            )
+        if spec["kind"] == "category":
+            return CategoryColumn(values=spec["values"], codes=ints(spec["codes"]))
+        return floats(spec["values"])
+
+    def postings(field: str, spec: dict[str, Any]) -> Postings:
+        return Postings(
+            source.category_column(field),
+            positions=ints(spec["positions"]),
+            offsets=ints(spec["offsets"]),
+        )
+
+    columns = {field: read_column(spec) for field, spec in meta["columns"].items()}
+    source = ProductStore(columns=columns, size=meta["size"])
+    served = ProductStore(
+        columns={
+            field: OverlayColumn(column, dict(map(tuple, overrides)))
+            if (overrides := meta["overrides"].get(field))
+            else column
+            for field, column in columns.items()
+        },
+        size=meta["size"],
+    )
+    return Catalog(
+        source=source,
+        served=served,
+        version=meta["version"],
+        fetched_at=monotonic_time(fetched_at),
+        index=CatalogIndex(
+            source,
+            price_order=ints(meta["price_order"]),
+            price_order_desc=ints(meta["price_order_desc"]),
+            sorted_prices=floats(meta["sorted_prices"]),
+            by_id=SortedIdIndex(
+                read_column(meta["by_id"]["ids"]), ints(meta["by_id"]["positions"])
+            ),
+            by_brand_id=postings("sif_productbrand", meta["by_brand_id"]),
+            by_category_id=postings("sif_productcategory", meta["by_category_id"]),
+        ),
+        etag=meta["etag"],
+        last_modified=meta["last_modified"],
+    )
+
+
+class SharedSnapshot:
+    """Catalog snapshot file shared by the workers of a host.
+
+    Whoever downloads a new catalog publishes it here, the others map the file
+    instead of holding their own copy. A lock file makes sure that only one
+    worker at a time refreshes the catalog from the upstream.
+    """
+
+    def __init__(self, directory: str):
+        self.path = Path(directory) / "catalog.snapshot"
+        self.lock_path = Path(directory) / "catalog.lock"
+        self.tokens_path = Path(directory) / "tokens.json"
+        self.tokens_lock_path = Path(directory) / "tokens.lock"
+        # identity of the file last read, to notice replacements cheaply
+        self.stat: tuple[int, int] | None = None
+
+    def current_stat(self) -> tuple[int, int] | None:
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns)
+
+    def changed(self) -> bool:
+        return self.current_stat() != self.stat
+
+    def load(self, current: Catalog | None) -> Catalog | None:
+        """The snapshot in the file, `current` when it holds the same version.
+        None when there is no snapshot yet"""
+        stat = self.current_stat()
+        if stat is None:
+            return None
+        if current is not None:
+            fetched_at, meta = read_metadata(self.path)
+            if meta["version"] == current.version:
+                self.stat = stat
+                return current.refreshed(fetched_at=monotonic_time(fetched_at))
+        catalog = read_snapshot(self.path)
+        self.stat = stat
+        return catalog
+
+    def publish(self, catalog: Catalog) -> Catalog:
+        """Writes a new catalog and returns it mapped from the file"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        write_snapshot(catalog, self.path, fetched_at=time.time())
+        self.stat = self.current_stat()
+        return read_snapshot(self.path)
+
+    def touch(self) -> None:
+        """Records that the upstream confirmed the snapshot just now"""
+        try:
+            fd = os.open(self.path, os.O_WRONLY)
+        except FileNotFoundError:
+            return
+        try:
+            os.pwrite(fd, struct.pack("<d", time.time()), FETCHED_AT_OFFSET)
+        finally:
+            os.close(fd)
+        self.stat = self.current_stat()
+
+    def load_tokens(self) -> dict[str, float]:
+        """Hashes of the tokens the upstream verified, with the wall clock time
+        their verification expires"""
+        try:
+            with open(self.tokens_path, "rb") as file:
+                tokens = json.load(file)
+        except FileNotFoundError:
+            return {}
+        return {key: float(until) for key, until in tokens.items()}
+
+    def update_tokens(self, updates: dict[str, float | None], keep: float) -> None:
+        """Merges verified tokens into the file, None removes a token. Tokens
+        whose verification expired more than `keep` seconds ago are dropped"""
+        import fcntl
+
+        self.tokens_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.tokens_lock_path, "a") as lock:
+            # workers update the file in turns, so no update is lost
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                try:
+                    tokens = self.load_tokens()
+                except ValueError:
+                    tokens = {}
+                for key, until in updates.items():
+                    if until is None:
+                        tokens.pop(key, None)
+                    else:
+                        tokens[key] = max(until, tokens.get(key, until))
+                now = time.time()
+                tokens = {
+                    key: until for key, until in tokens.items() if until + keep > now
+                }
+                replace_file(self.tokens_path, json.dumps(tokens).encode())
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @contextmanager
+    def lock(self) -> Generator[bool]:
+        """Tries to take the refresh lock without waiting, yields whether it was
+        taken. The lock is released with the file, also when the worker dies"""
+        import fcntl
+
+        self.lock_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, "a") as file:
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
@@ -0,0 +1,210 @@
+from array import array
+from collections.abc import Iterator
+from typing import Any, Protocol
+
+from app.models import Product
+
+# fields with few distinct values are dictionary encoded, the rest is packed text
+CATEGORY_FIELDS = frozenset(
+    {
+        "vat",
+        "stock",
+        "sif_productcategory",
+        "sif_productbrand",
+        "categoryName",
+        "brandName",
+    }
+)
+NUMBER_FIELDS = frozenset({"price"})
+PRODUCT_FIELDS = tuple(Product.model_fields)
+
+# arrays, or typed views of a memory mapped snapshot file (see app/snapshot.py)
+type Buffer = array | memoryview
+
+
+class Column(Protocol):
+    def __len__(self) -> int: ...
+
+    def __getitem__(self, pos: int, /): ...
+
+
+class ColumnBuilder(Protocol):
+    def __len__(self) -> int: ...
+
+    def append(self, value, /) -> None: ...
+
+    def build(self) -> Column: ...
+
+
+class TextColumn:
+    """Strings packed as UTF-8 into one buffer and addressed by offsets"""
+
+    def __init__(
+        self,
+        data: bytes | memoryview,
+        offsets: Buffer,
+        nulls: bytes | memoryview | None = None,
+    ):
+        self.data = data
+        self.offsets = offsets
+        self.nulls = nulls
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, pos: int) -> str | None:
+        if self.nulls is not None and self.nulls[pos]:
+            return None
+        return str(self.data[self.offsets[pos] : self.offsets[pos + 1]], "utf-8")
+
+    def __iter__(self) -> Iterator[str | None]:
+        return (self[pos] for pos in range(len(self)))
+
+
+class TextColumnBuilder:
+    def __init__(self):
+        self.data = bytearray()
+        self.offsets = array("I", [0])
+        self.nulls = bytearray()
+
+    def __len__(self) -> int:
+        return len(self.nulls)
+
+    def append(self, value: str | None) -> None:
+        if value is not None:
+            self.data += value.encode()
+        self.offsets.append(len(self.data))
+        self.nulls.append(value is None)
+
+    def build(self) -> TextColumn:
+        return TextColumn(
+            data=bytes(self.data),
+            offsets=self.offsets,
+            nulls=bytes(self.nulls) if any(self.nulls) else None,
+        )
+
+
+class CategoryColumn:
+    """Dictionary encoded strings, every distinct value is stored once"""
+
+    def __init__(self, values: list[str | None], codes: Buffer):
+        self.values = values
+        self.codes = codes
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, pos: int) -> str | None:
+        return self.values[self.codes[pos]]
+
+    def __iter__(self) -> Iterator[str | None]:
+        values = self.values
+        return (values[code] for code in self.codes)
+
+
+class CategoryColumnBuilder:
+    def __init__(self):
+        self.lookup: dict[str | None, int] = {}
+        self.codes = array("I")
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def append(self, value: str | None) -> None:
+        code = self.lookup.get(value)
+        if code is None:
+            code = self.lookup[value] = len(self.lookup)
+        self.codes.append(code)
+
+    def build(self) -> CategoryColumn:
+        # the lookup keeps insertion order, which is the code order
+        return CategoryColumn(values=list(self.lookup), codes=self.codes)
+
+
+class NumberColumnBuilder:
+    def __init__(self):
+        self.values = array("d")
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def append(self, value: float) -> None:
+        self.values.append(value)
+
+    def build(self) -> array:
+        return self.values
+
+
+class OverlayColumn:
+    """A column with a few positions overridden, e.g. by product processing"""
+
+    def __init__(self, base: Column, overrides: dict[int, Any]):
+        self.base = base
+        self.overrides = overrides
+
+    def __len__(self) -> int:
+        return len(self.base)
+
+    def __getitem__(self, pos: int) -> Any:
+        if pos in self.overrides:
+            return self.overrides[pos]
+        return self.base[pos]
+
+
+def column_builder(field: str) -> ColumnBuilder:
+    if field in CATEGORY_FIELDS:
+        return CategoryColumnBuilder()
+    if field in NUMBER_FIELDS:
+        return NumberColumnBuilder()
+    return TextColumnBuilder()
+
+
+class ProductStore:
+    """Struct-of-arrays product storage, one column per `Product` field.
+
+    `Product` models are only materialized for the positions that are read.
+    """
+
+    def __init__(self, columns: dict[str, Column], size: int):
+        self.columns = columns
+        self.size = size
+
+    def __len__(self) -> int:
+        return self.size
+
+    def column(self, field: str) -> Column:
+        return self.columns[field]
+
+    def category_column(self, field: str) -> CategoryColumn:
+        column = self.columns[field]
+        if not isinstance(column, CategoryColumn):
+            raise TypeError(f"field {field} is not dictionary encoded")
+        return column
+
+    def number_column(self, field: str) -> Buffer:
+        column = self.columns[field]
+        if not isinstance(column, array | memoryview):
+            raise TypeError(f"field {field} is not numeric")
+        return column
+
+    def product(self, pos: int) -> Product:
+        return Product.model_construct(
+            **{field: column[pos] for field, column in self.columns.items()}
+        )
+
+
+class ProductStoreBuilder:
+    def __init__(self):
+        self.columns = {field: column_builder(field) for field in PRODUCT_FIELDS}
+        self.size = 0
+
+    def append(self, product: Product) -> None:
+        for field, column in self.columns.items():
+            column.append(getattr(product, field))
+        self.size += 1
+
+    def build(self) -> ProductStore:
+        return ProductStore(
+            columns={field: c.build() for field, c in self.columns.items()},
+            size=self.size,
+        )
@@ -0,0 +1,81 @@
+import base64
+import hashlib
+import hmac
+import json
+import secrets
+import time
+from collections import OrderedDict
+
+from app.models import LoginRequest, TokenResponse
+
+
+def token_expiry(token: str) -> float | None:
+    """The `exp` claim of a JWT, read without verifying the signature"""
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(
+            base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+        )
+        exp = claims["exp"]
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+    if isinstance(exp, bool) or not isinstance(exp, int | float):
+        return None
+    return float(exp)
+
+
+class TokenCache:
+    """Upstream tokens per credentials, until shortly before they expire.
+
+    Credentials are keyed by an HMAC with a key that only lives in this
+    process, so the keys do not help guessing passwords. Tokens without an
+    `exp` claim are not cached.
+    """
+
+    def __init__(self, max_entries: int, refresh_margin: float):
+        self.max_entries = max_entries
+        self.refresh_margin = refresh_margin
+        self.secret = secrets.token_bytes(32)
+        # key -> (token, wall clock time to refresh it at)
+        self.entries: OrderedDict[str, tuple[TokenResponse, float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def key(self, login_req: LoginRequest) -> str:
+        credentials = f"{login_req.username}\0{login_req.password}".encode()
+        return hmac.new(self.secret, credentials, hashlib.sha256).hexdigest()
+
+    def get(self, key: str) -> TokenResponse | None:
+        entry = self.entries.get(key)
+        if entry is None or entry[1] <= time.time():
+            self.entries.pop(key, None)
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[0]
+
+    def discard(self, key: str) -> None:
+        self.entries.pop(key, None)
+
+    def put(self, key: str, token: TokenResponse) -> None:
+        exp = token_expiry(token.token)
+        if exp is None or self.max_entries <= 0:
+            return
+        refresh_at = exp - self.refresh_margin
+        if refresh_at <= time.time():
+            return
+        self.entries[key] = (token, refresh_at)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
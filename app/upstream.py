@@ -0,0 +1,77 @@
+import random
+import time
+
+import httpx
+
+from app.config import UpstreamConfig
+
+
+def create_client(base_url: str, config: UpstreamConfig) -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        base_url=base_url,
+        headers={"Content-Type": "application/json", "Accept": "application/json"},
+        limits=httpx.Limits(
+            max_connections=config.max_connections,
+            max_keepalive_connections=config.max_keepalive_connections,
+            keepalive_expiry=config.keepalive_expiry,
+        ),
+        timeout=config.timeout(config.read_timeout),
+        http2=config.http2,
+    )
+
+
+def is_retryable(error: Exception) -> bool:
+    """Failures of the upstream, as opposed to rejections of our request. Any
+    5xx means the upstream or a proxy in front of it failed"""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.is_server_error
+    return isinstance(error, httpx.TransportError)
+
+
+def backoff(attempt: int, base: float, cap: float) -> float:
+    """Full jitter exponential backoff before retry `attempt` (from 1)"""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """Stops calling an upstream that keeps failing.
+
+    Opens after `max_failures` consecutive failures, calls then fail fast until
+    `reset_timeout` passed. A single trial call is let through after that, its
+    outcome closes the circuit again or keeps it open for another timeout.
+    """
+
+    def __init__(self, max_failures: int, reset_timeout: float):
+        self.max_failures = max_failures
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+        self.trial = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if self.trial or time.monotonic() - self.opened_at < self.reset_timeout:
+            return False
+        self.trial = True
+        return True
+
+    def record_success(self) -> None:
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def record_unknown(self) -> None:
+        """The call ended without telling whether the upstream works, e.g. it
+        was cancelled, a trial call is let through next time"""
+        self.trial = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self.trial = False
+        if self.opened_at is not None or self.failures >= self.max_failures:
+            self.opened_at = time.monotonic()
@@ -0,0 +1,283 @@
+"""Drives the app against a local stand-in upstream with a realistic query mix.
+
+uv run python -m benchmarks.api --scale 10 --requests 5000 --concurrency 32
+
+Reports throughput, latency percentiles per request kind, upstream calls and
+peak RSS of the app process (the stand-in runs in its own process), plus how
+long the event loop was blocked, e.g. while the catalog loads. Use --json to
+compare runs.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from pathlib import Path
+
+import httpx
+
+from app.metrics import Metrics
+from app.offload import LoopLagMonitor
+from benchmarks.upstream import synthetic_catalog
+
+ROOT = Path(__file__).resolve().parent.parent
+# share of each kind of request in the mix
+MIX = {"list": 45, "search": 10, "product": 25, "batch": 10, "facets": 10}
+# distinct queries per kind, popular ones are asked much more often
+POOL_SIZE = 200
+# seconds between event loop lag samples, as the app samples by default
+LOOP_LAG_INTERVAL = 0.1
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_upstream(port: int, scale: int, latency: float) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "benchmarks.upstream",
+            "--port",
+            str(port),
+            "--scale",
+            str(scale),
+            "--latency",
+            str(latency),
+        ],
+        cwd=ROOT,
+    )
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/_stats").raise_for_status()
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("the stand-in upstream did not start")
+
+
+def query_pools(catalog: bytes, rng: random.Random) -> dict[str, list[str]]:
+    products = json.loads(catalog)
+    ids = [p["sif_product"] for p in products]
+    brands = [p["sif_productbrand"] for p in products if p["sif_productbrand"]]
+    categories = [p["sif_productcategory"] for p in products]
+    words = [w for p in products for w in p["naziv"].split() if len(w) > 3]
+    sorts = [None, "price", "-price", "naziv", "categoryName,-price"]
+
+    def listing() -> str:
+        params = {
+            "page": rng.choice([1, 1, 1, 2, 3, 5]),
+            "page_size": rng.choice([20, 50]),
+        }
+        if rng.random() < 0.4:
+            params["category_ids"] = rng.choice(categories)
+        if rng.random() < 0.3:
+            params["brand_ids"] = ",".join(rng.sample(brands, rng.randint(1, 3)))
+        if rng.random() < 0.3:
+            params["price_gte"] = rng.choice([1000, 5000, 10000])
+            params["price_lte"] = params["price_gte"] * rng.choice([2, 5, 10])
+        if sort := rng.choice(sorts):
+            params["sort"] = sort
+        return "/products?" + "&".join(f"{k}={v}" for k, v in params.items())
+
+    def search() -> str:
+        return f"/products?name={rng.choice(words)}&page_size=20"
+
+    def product() -> str:
+        return f"/products/{rng.choice(ids)}"
+
+    def batch() -> str:
+        return "/products/batch?ids=" + ",".join(rng.sample(ids, rng.randint(5, 40)))
+
+    def facets() -> str:
+        if rng.random() < 0.5:
+            return f"/products/facets?category_ids={rng.choice(categories)}"
+        return "/products/facets"
+
+    makers = {
+        "list": listing,
+        "search": search,
+        "product": product,
+        "batch": batch,
+        "facets": facets,
+    }
+    return {kind: [make() for _ in range(POOL_SIZE)] for kind, make in makers.items()}
+
+
+def request_mix(
+    pools: dict[str, list[str]], count: int, rng: random.Random
+) -> list[tuple[str, str]]:
+    kinds = rng.choices(list(MIX), weights=list(MIX.values()), k=count)
+    # zipf like popularity within each pool
+    popularity = [1 / (rank + 1) for rank in range(POOL_SIZE)]
+    return [(kind, rng.choices(pools[kind], weights=popularity)[0]) for kind in kinds]
+
+
+def percentiles(latencies: list[float]) -> dict[str, float]:
+    if len(latencies) < 2:
+        latencies = latencies * 2 or [0.0, 0.0]
+    cuts = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "count": len(latencies),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "p50_ms": round(cuts[49] * 1000, 3),
+        "p95_ms": round(cuts[94] * 1000, 3),
+        "p99_ms": round(cuts[98] * 1000, 3),
+    }
+
+
+async def drive(
+    requests: list[tuple[str, str]], concurrency: int, upstream_url: str
+) -> dict:
+    # the app reads its configuration while it is imported and started
+    os.environ["KONOVO_UPSTREAM_URL"] = upstream_url
+    from app.main import app
+
+    latencies: dict[str, list[float]] = defaultdict(list)
+    statuses: Counter[int] = Counter()
+    # the app only samples its loop lag with metrics enabled
+    loop_monitor = LoopLagMonitor(LOOP_LAG_INTERVAL, Metrics(enabled=False))
+    loop_monitor.start()
+    transport = httpx.ASGITransport(app=app)
+    async with (
+        app.router.lifespan_context(app),
+        httpx.AsyncClient(transport=transport, base_url="http://app") as client,
+    ):
+        res = await client.post(
+            "/auth/login", json={"username": "benchmark", "password": "benchmark"}
+        )
+        headers = {"Authorization": f"Bearer {res.json()['token']}"}
+
+        async def cold_request() -> float:
+            started = time.perf_counter()
+            await client.get("/products?page_size=20", headers=headers)
+            return time.perf_counter() - started
+
+        # cheap requests answered while the catalog loads, they wait for as
+        # long as the catalog work blocks the event loop
+        cold = asyncio.create_task(cold_request())
+        probes: list[float] = []
+        while not cold.done():
+            started = time.perf_counter()
+            await asyncio.sleep(0.005)
+            await client.get("/healthz")
+            # from when the probe was due, the loop may wake up late
+            probes.append(time.perf_counter() - started - 0.005)
+        cold_start = await cold
+
+        pending = iter(requests)
+
+        async def worker() -> None:
+            for kind, url in pending:
+                started = time.perf_counter()
+                res = await client.get(url, headers=headers)
+                latencies[kind].append(time.perf_counter() - started)
+                statuses[res.status_code] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+    await loop_monitor.aclose()
+
+    every = [latency for kind in latencies.values() for latency in kind]
+    return {
+        "cold_start_ms": round(cold_start * 1000, 3),
+        "cold_probe_max_ms": round(max(probes, default=0.0) * 1000, 3),
+        "loop_lag_max_ms": round(loop_monitor.max * 1000, 3),
+        "seconds": round(elapsed, 3),
+        "throughput_rps": round(len(every) / elapsed, 1),
+        "latency": {
+            "all": percentiles(every),
+            **{kind: percentiles(values) for kind, values in sorted(latencies.items())},
+        },
+        "statuses": dict(statuses),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=20.0, help="upstream ms")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="machine readable output")
+    parser.add_argument("--print-requests", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.print_requests:
+        rng = random.Random(args.seed)
+        pools = query_pools(synthetic_catalog(args.scale), rng)
+        print(json.dumps(request_mix(pools, args.requests, rng)))
+        return
+
+    # the query mix is drawn from the catalog in a fresh interpreter, so that
+    # the peak RSS below is the app's and not the decoded catalog's
+    requests = [
+        (kind, path)
+        for kind, path in json.loads(
+            subprocess.run(
+                [sys.executable, "-m", "benchmarks.api", "--print-requests"]
+                + ["--scale", str(args.scale), "--requests", str(args.requests)]
+                + ["--seed", str(args.seed)],
+                cwd=ROOT,
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+        )
+    ]
+
+    port = free_port()
+    upstream = start_upstream(port, scale=args.scale, latency=args.latency)
+    try:
+        url = f"http://127.0.0.1:{port}"
+        results = asyncio.run(drive(requests, args.concurrency, upstream_url=url))
+        results["upstream"] = httpx.get(f"{url}/_stats").json()
+    finally:
+        upstream.terminate()
+        upstream.wait()
+    # ru_maxrss is in kilobytes on Linux
+    results["peak_rss_mb"] = round(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+    )
+    results["config"] = vars(args)
+
+    if args.json:
+        print(json.dumps(results))
+        return
+    print(
+        f"x{args.scale}, {args.requests} requests, concurrency {args.concurrency},"
+        f" upstream latency {args.latency:.0f} ms"
+    )
+    print(
+        f"cold start {results['cold_start_ms']:.1f} ms,"
+        f" {results['throughput_rps']:.0f} req/s, peak RSS {results['peak_rss_mb']} MB"
+    )
+    print(
+        f"slowest /healthz during the cold start {results['cold_probe_max_ms']:.1f} ms,"
+        f" max event loop lag {results['loop_lag_max_ms']} ms"
+    )
+    for kind, r in results["latency"].items():
+        print(
+            f"{kind:8} {r['count']:6}  p50 {r['p50_ms']:8.2f} ms"
+            f"  p95 {r['p95_ms']:8.2f} ms  p99 {r['p99_ms']:8.2f} ms"
+        )
+    print(f"statuses {results['statuses']}, upstream calls {results['upstream']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,184 @@
+"""Checks the filter plan against the sequential filters it replaced and
+compares their speed on random filter combinations.
+
+uv run python -m benchmarks.filters --scale 10 --queries 2000
+
+Exits with an error when any query selects different products.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from bisect import bisect_left, bisect_right
+from collections.abc import Callable, Iterable, Sequence
+
+from app.catalog import Catalog, CatalogBuilder, CatalogIndex, Postings
+from app.ingest import parse_products
+from app.models import ProductFilters
+from app.plan import FilterPlan
+from app.processing import DEFAULT_PRODUCT_TRANSFORMS
+from app.query import PriceBounds, parse_ids
+from benchmarks.upstream import synthetic_catalog
+
+
+def union(postings: Postings, keys: Iterable[str]) -> set[int]:
+    positions: set[int] = set()
+    for key in set(keys):
+        positions.update(postings.get(key) or ())
+    return positions
+
+
+def price_positions(index: CatalogIndex, bounds: PriceBounds) -> Sequence[int]:
+    """Positions with a price within the bounds, in ascending price order"""
+    lo, hi = 0, len(index.sorted_prices)
+    if bounds.min_price is not None:
+        bisect = bisect_left if bounds.min_inclusive else bisect_right
+        lo = bisect(index.sorted_prices, bounds.min_price)
+    if bounds.max_price is not None:
+        bisect = bisect_right if bounds.max_inclusive else bisect_left
+        hi = bisect(index.sorted_prices, bounds.max_price)
+    return index.price_order[lo:hi]
+
+
+def legacy_filter(
+    catalog: Catalog, filters: ProductFilters, fold_diacritics: bool
+) -> list[int]:
+    """Filters one after the other in a fixed order, as before the plan"""
+    selected: set[int] | None = None
+    if filters.category_ids:
+        selected = union(catalog.index.by_category_id, parse_ids(filters.category_ids))
+    if filters.brand_ids:
+        brand_positions = union(catalog.index.by_brand_id, parse_ids(filters.brand_ids))
+        selected = brand_positions if selected is None else selected & brand_positions
+    bounds = PriceBounds(filters)
+    if bounds:
+        in_range = price_positions(catalog.index, bounds)
+        selected = (
+            set(in_range) if selected is None else selected.intersection(in_range)
+        )
+    positions: list[int] | None = None if selected is None else sorted(selected)
+    texts = [
+        ("categoryName", None if filters.category_ids else filters.category),
+        ("brandName", None if filters.brand_ids else filters.brand),
+        ("naziv", filters.name),
+    ]
+    for field, needle in texts:
+        if needle:
+            search_index = catalog.search_index(field, fold_diacritics=fold_diacritics)
+            positions = search_index.search(needle, positions=positions)
+    if positions is None:
+        positions = list(range(len(catalog)))
+    return positions
+
+
+def random_filters(products: list[dict], rng: random.Random) -> ProductFilters:
+    def pick(field: str) -> str:
+        return str(rng.choice(products)[field] or "")
+
+    def ids(field: str) -> list[str] | None:
+        if rng.random() > 0.3:
+            return None
+        values = [pick(field) for _ in range(rng.randint(1, 4))]
+        if rng.random() < 0.2:
+            values.append(rng.choice(["", "999999", " "]))
+        if rng.random() < 0.5:
+            # repeated query parameters instead of a comma separated list
+            return values
+        return [",".join(values)]
+
+    def text(field: str) -> str | None:
+        if rng.random() > 0.3:
+            return None
+        words = pick(field).split() or ["x"]
+        word = rng.choice(words)
+        start = rng.randint(0, max(0, len(word) - 2))
+        # whole words, prefixes and fragments down to a single letter
+        needle = word[start : start + rng.randint(1, len(word) + 1)]
+        return rng.choice([needle, needle.upper(), needle.lower(), "zzzq"])
+
+    def price() -> float | None:
+        if rng.random() > 0.25:
+            return None
+        # existing prices probe the bounds, others fall between them
+        value = float(rng.choice(products)["price"])
+        return rng.choice([value, round(value * rng.uniform(0.5, 2))])
+
+    return ProductFilters(
+        name=text("naziv"),
+        brand_ids=ids("sif_productbrand"),
+        category_ids=ids("sif_productcategory"),
+        brand=text("brandName"),
+        category=text("categoryName"),
+        price_lt=price(),
+        price_lte=price(),
+        price_gt=price(),
+        price_gte=price(),
+        sort=None,
+    )
+
+
+def timed(fn: Callable[[], list[int]]) -> tuple[float, list[int]]:
+    started = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - started, result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", action="store_true", help="machine readable output")
+    args = parser.parse_args()
+
+    content = synthetic_catalog(args.scale, seed=args.seed)
+    builder = CatalogBuilder(DEFAULT_PRODUCT_TRANSFORMS)
+    builder.extend(parse_products(content))
+    catalog = builder.build(version="benchmark", fetched_at=time.monotonic())
+    products = json.loads(content)
+    rng = random.Random(args.seed)
+    queries = [random_filters(products, rng) for _ in range(args.queries)]
+
+    legacy_seconds = plan_seconds = 0.0
+    mismatches = 0
+    for fold_diacritics in (True, False):
+        # search indexes are built on first use, outside of the timings
+        for field in ("naziv", "brandName", "categoryName"):
+            catalog.search_index(field, fold_diacritics=fold_diacritics)
+        for filters in queries:
+            seconds, expected = timed(
+                lambda: legacy_filter(catalog, filters, fold_diacritics)
+            )
+            legacy_seconds += seconds
+            seconds, actual = timed(
+                lambda: FilterPlan(filters, fold_diacritics).execute(catalog)
+            )
+            plan_seconds += seconds
+            if actual != expected:
+                mismatches += 1
+                print(f"mismatch: {filters!r}", file=sys.stderr)
+
+    results = {
+        "products": len(catalog),
+        "queries": 2 * len(queries),
+        "mismatches": mismatches,
+        "legacy_ms_per_query": round(legacy_seconds * 1000 / (2 * len(queries)), 4),
+        "plan_ms_per_query": round(plan_seconds * 1000 / (2 * len(queries)), 4),
+    }
+    if args.json:
+        print(json.dumps(results))
+    else:
+        print(
+            f"{results['products']} products, {results['queries']} queries,"
+            f" {mismatches} mismatches"
+        )
+        print(f"{'sequential filters':24} {results['legacy_ms_per_query']:8.3f} ms")
+        print(f"{'filter plan':24} {results['plan_ms_per_query']:8.3f} ms")
+    if mismatches:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
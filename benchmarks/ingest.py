@@ -0,0 +1,107 @@
+"""Compares catalog ingestion paths by wall time and peak traced memory.
+
+uv run python -m benchmarks.ingest --scale 10
+"""
+
+import argparse
+import asyncio
+import gc
+import json
+import time
+import tracemalloc
+from collections.abc import AsyncIterator, Callable
+from pathlib import Path
+
+from pydantic import TypeAdapter
+
+from app.ingest import parse_products, stream_products
+from app.models import Product
+
+CATALOG_PATH = Path(__file__).resolve().parent.parent / "products_list.json"
+CHUNK_SIZE = 64 * 1024
+
+
+def scaled_catalog(scale: int) -> bytes:
+    products = json.loads(CATALOG_PATH.read_bytes())
+    scaled = [
+        {**p, "sif_product": f"{p['sif_product']}{copy:03d}"}
+        for copy in range(scale)
+        for p in products
+    ]
+    return json.dumps(scaled, ensure_ascii=False).encode()
+
+
+def legacy_path(content: bytes) -> list[Product]:
+    return TypeAdapter(list[Product]).validate_python(json.loads(content))
+
+
+def bytes_path(content: bytes) -> list[Product]:
+    return parse_products(content)
+
+
+def streaming_path(content: bytes) -> list[Product]:
+    async def chunks() -> AsyncIterator[bytes]:
+        for start in range(0, len(content), CHUNK_SIZE):
+            yield content[start : start + CHUNK_SIZE]
+
+    async def collect() -> list[Product]:
+        return [product async for product in stream_products(chunks())]
+
+    return asyncio.run(collect())
+
+
+def measure(
+    fn: Callable[[bytes], list[Product]], content: bytes
+) -> tuple[float, float, float]:
+    gc.collect()
+    started = time.perf_counter()
+    products = fn(content)
+    elapsed = time.perf_counter() - started
+    del products
+
+    gc.collect()
+    tracemalloc.start()
+    products = fn(content)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del products
+    return elapsed, current, peak
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scale", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="machine readable output")
+    args = parser.parse_args()
+
+    content = scaled_catalog(args.scale)
+    results = {}
+    # the buffered paths also hold the whole response body while validating
+    for name, fn, body in (
+        ("legacy json()+validate_python", legacy_path, len(content)),
+        ("validate_json(bytes)", bytes_path, len(content)),
+        ("streaming", streaming_path, CHUNK_SIZE),
+    ):
+        elapsed, retained, peak = measure(fn, content)
+        peak += body
+        results[name] = {
+            "seconds": round(elapsed, 4),
+            "retained_mb": round(retained / 2**20, 2),
+            "peak_mb": round(peak / 2**20, 2),
+            # memory used on top of the retained products while ingesting
+            "transient_mb": round((peak - retained) / 2**20, 2),
+        }
+
+    if args.json:
+        print(json.dumps({"payload_mb": len(content) / 2**20, "results": results}))
+        return
+    print(f"payload: {len(content) / 2**20:.1f} MB (x{args.scale})")
+    for name, r in results.items():
+        print(
+            f"{name:32} {r['seconds']:8.3f}s  peak {r['peak_mb']:8.1f} MB"
+            f"  transient {r['transient_mb']:8.1f} MB"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""Compares the retained memory of a plain product list and a catalog snapshot.
+
+uv run python -m benchmarks.memory --scale 10
+"""
+
+import argparse
+import gc
+import json
+import os
+import subprocess
+import sys
+import tracemalloc
+from collections.abc import Sized
+
+from app.catalog import CatalogBuilder
+from app.ingest import PRODUCT_ADAPTER, JSONArrayDecoder, parse_products
+from app.processing import DEFAULT_PRODUCT_TRANSFORMS
+from benchmarks.ingest import CHUNK_SIZE, scaled_catalog
+
+VARIANTS = ("list[Product]", "Catalog")
+
+
+def rss_bytes() -> int | None:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return None
+
+
+def load(variant: str, content: bytes) -> Sized:
+    if variant == "list[Product]":
+        return parse_products(content)
+    # products are encoded as they are decoded, like the streaming ingestion
+    decoder = JSONArrayDecoder()
+    builder = CatalogBuilder(DEFAULT_PRODUCT_TRANSFORMS)
+    for start in range(0, len(content), CHUNK_SIZE):
+        for item in decoder.feed(content[start : start + CHUNK_SIZE]):
+            builder.append(PRODUCT_ADAPTER.validate_python(item))
+    for item in decoder.feed(b"", final=True):
+        builder.append(PRODUCT_ADAPTER.validate_python(item))
+    return builder.build(version="benchmark", fetched_at=0.0)
+
+
+def measure(variant: str, scale: int) -> dict[str, float | None]:
+    content = scaled_catalog(scale)
+    gc.collect()
+    rss_before = rss_bytes()
+    tracemalloc.start()
+    loaded = load(variant, content)
+    gc.collect()
+    traced, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = rss_bytes()
+    per_10k = 10_000 / len(loaded)
+    del loaded
+    return {
+        "traced_mb_per_10k": round(traced * per_10k / 2**20, 2),
+        "rss_mb_per_10k": (
+            round((rss_after - rss_before) * per_10k / 2**20, 2)
+            if rss_before is not None and rss_after is not None
+            else None
+        ),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scale", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="machine readable output")
+    parser.add_argument("--variant", choices=VARIANTS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variant:
+        print(json.dumps(measure(args.variant, args.scale)))
+        return
+
+    # every variant runs in a fresh interpreter so RSS is not shared between them
+    results = {
+        variant: json.loads(
+            subprocess.run(
+                [sys.executable, "-m", "benchmarks.memory", "--variant", variant]
+                + ["--scale", str(args.scale)],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+        )
+        for variant in VARIANTS
+    }
+    if args.json:
+        print(json.dumps({"scale": args.scale, "results": results}))
+        return
+    for variant, r in results.items():
+        print(
+            f"{variant:16} traced {r['traced_mb_per_10k']:7.2f} MB/10k products"
+            f"  rss {r['rss_mb_per_10k']} MB/10k products"
+        )
+
+
+if __name__ == "__main__":
+    main()
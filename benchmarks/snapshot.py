@@ -0,0 +1,94 @@
+"""Compares a cold catalog load from the upstream JSON with a snapshot restore.
+
+uv run python -m benchmarks.snapshot --scale 10
+"""
+
+import argparse
+import asyncio
+import json
+import tempfile
+import time
+from pathlib import Path
+
+from app.catalog import Catalog, CatalogBuilder, build_catalog_json
+from app.ingest import parse_products
+from app.offload import WorkerPool
+from app.processing import DEFAULT_PRODUCT_TRANSFORMS
+from app.snapshot import read_snapshot, write_snapshot
+from benchmarks.ingest import scaled_catalog
+
+
+def build(content: bytes) -> Catalog:
+    builder = CatalogBuilder(DEFAULT_PRODUCT_TRANSFORMS)
+    builder.extend(parse_products(content))
+    return builder.build(version="benchmark", fetched_at=time.monotonic())
+
+
+def timed[T](fn, *args) -> tuple[float, T]:
+    started = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - started, result
+
+
+async def build_in_process(content: bytes) -> tuple[float, Catalog]:
+    """Builds the catalog in a worker process like KONOVO_CATALOG_EXECUTOR=process,
+    the result is pickled back"""
+    pool = WorkerPool("process", workers=1, queue=0, name="benchmark")
+    try:
+        # the spawn and imports are paid once per worker, not per load
+        await pool.run(build_catalog_json, b"[]", DEFAULT_PRODUCT_TRANSFORMS, "", 0.0)
+        started = time.perf_counter()
+        catalog, _ = await pool.run(
+            build_catalog_json,
+            content,
+            DEFAULT_PRODUCT_TRANSFORMS,
+            version="benchmark",
+            fetched_at=time.monotonic(),
+        )
+        return time.perf_counter() - started, catalog
+    finally:
+        pool.shutdown()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--scale", type=int, default=10)
+    parser.add_argument("--json", action="store_true", help="machine readable output")
+    args = parser.parse_args()
+
+    content = scaled_catalog(args.scale)
+    build_seconds, catalog = timed(build, content)
+    process_seconds, built = asyncio.run(build_in_process(content))
+    assert built.take(range(len(built))) == catalog.take(range(len(catalog)))
+    with tempfile.TemporaryDirectory() as directory:
+        path = Path(directory) / "catalog.snapshot"
+        write_seconds, _ = timed(write_snapshot, catalog, path, time.time())
+        read_seconds, restored = timed(read_snapshot, path)
+        snapshot_mb = path.stat().st_size / 2**20
+        # every product reads back the same as from the built catalog
+        assert restored.take(range(len(restored))) == catalog.take(range(len(catalog)))
+    results = {
+        "products": len(catalog),
+        "payload_mb": round(len(content) / 2**20, 2),
+        "snapshot_mb": round(snapshot_mb, 2),
+        "build_seconds": round(build_seconds, 4),
+        "process_build_seconds": round(process_seconds, 4),
+        "write_seconds": round(write_seconds, 4),
+        "restore_seconds": round(read_seconds, 4),
+    }
+
+    if args.json:
+        print(json.dumps(results))
+        return
+    print(
+        f"{results['products']} products, payload {results['payload_mb']:.1f} MB,"
+        f" snapshot {results['snapshot_mb']:.1f} MB"
+    )
+    print(f"{'parse + build from JSON':32} {build_seconds:8.3f}s")
+    print(f"{'the same in a worker process':32} {process_seconds:8.3f}s")
+    print(f"{'write snapshot':32} {write_seconds:8.3f}s")
+    print(f"{'restore snapshot':32} {read_seconds:8.3f}s")
+
+
+if __name__ == "__main__":
+    main()
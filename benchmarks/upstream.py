@@ -0,0 +1,101 @@
+"""Local stand-in for the Konovo upstream, serving real or synthetic catalogs.
+
+uv run python -m benchmarks.upstream --port 8100 --scale 10 --latency 50
+
+Point the app at it with KONOVO_UPSTREAM_URL=http://127.0.0.1:8100, any
+credentials log in. GET /_stats reports the calls served so far.
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import json
+import random
+
+import uvicorn
+from fastapi import FastAPI, Request, Response
+
+from benchmarks.ingest import CATALOG_PATH
+
+# far in the future, the stand-in tokens never expire
+TOKEN_EXP = 4102444800
+
+
+def synthetic_catalog(scale: int, seed: int = 0) -> bytes:
+    """`products_list.json` at `scale` times its size.
+
+    Products are drawn from the real catalog, so brands, categories and
+    descriptions keep their distribution, with unique ids and prices varied a
+    little so that sorting by price is not dominated by ties.
+    """
+    products = json.loads(CATALOG_PATH.read_bytes())
+    if scale == 1:
+        return json.dumps(products, ensure_ascii=False).encode()
+    rng = random.Random(seed)
+    synthetic = []
+    for i in range(len(products) * scale):
+        product = dict(rng.choice(products))
+        product["sif_product"] = str(100000 + i)
+        product["sku"] = f"{product['sku']}-{i}"
+        product["price"] = round(product["price"] * rng.uniform(0.9, 1.1), 2)
+        synthetic.append(product)
+    return json.dumps(synthetic, ensure_ascii=False).encode()
+
+
+def make_token(username: str) -> str:
+    def encode(data: dict) -> str:
+        return base64.urlsafe_b64encode(json.dumps(data).encode()).decode().rstrip("=")
+
+    header = encode({"alg": "none", "typ": "JWT"})
+    return f"{header}.{encode({'sub': username, 'exp': TOKEN_EXP})}.standin"
+
+
+def create_upstream(catalog: bytes, latency: float = 0.0) -> FastAPI:
+    """The upstream endpoints the app uses, each answering after `latency`
+    seconds. Catalog requests with a matching If-None-Match get a 304"""
+    app = FastAPI()
+    etag = f'"{hashlib.sha256(catalog).hexdigest()[:32]}"'
+    stats = {"login": 0, "products": 0, "products_not_modified": 0}
+
+    @app.post("/login")
+    async def login(request: Request) -> dict[str, str]:
+        stats["login"] += 1
+        await asyncio.sleep(latency)
+        body = await request.json()
+        return {"token": make_token(str(body.get("username")))}
+
+    @app.get("/products")
+    async def products(request: Request) -> Response:
+        stats["products"] += 1
+        await asyncio.sleep(latency)
+        if not request.headers.get("authorization", "").startswith("Bearer "):
+            return Response(status_code=401)
+        if request.headers.get("if-none-match") == etag:
+            stats["products_not_modified"] += 1
+            return Response(status_code=304, headers={"ETag": etag})
+        return Response(
+            content=catalog, media_type="application/json", headers={"ETag": etag}
+        )
+
+    @app.get("/_stats")
+    async def get_stats() -> dict[str, int]:
+        return stats
+
+    return app
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--scale", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.0, help="milliseconds")
+    args = parser.parse_args()
+
+    app = create_upstream(synthetic_catalog(args.scale), latency=args.latency / 1000)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()